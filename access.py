@@ -0,0 +1,116 @@
+from functools import wraps
+
+from flask import abort, current_app, session
+from sqlalchemy import event, or_, select, union
+from sqlalchemy.orm import Session, object_session
+
+from cache import TTLCache
+from models import db, GroceryList, ListShare
+
+ACCESS_CACHE_SIZE = 10000
+# Invalidation is per process, so other workers may keep serving a revoked
+# share for at most this long. New shares are picked up immediately (see
+# ListAccess.can_access).
+ACCESS_CACHE_TTL = 60
+
+
+def access_query(user_id):
+    # Live lists the user owns or has been shared
+    owned = select(GroceryList.id).where(or_(
+        GroceryList.user_id == user_id,
+        GroceryList.created_by == user_id,
+    ))
+    shared = select(ListShare.list_id).where(ListShare.user_id == user_id)
+    return select(GroceryList.id).where(
+        GroceryList.id.in_(union(owned, shared)),
+        GroceryList.deleted_at.is_(None),
+    )
+
+
+class ListAccess:
+    # Answers "can user U touch list L" from a cached set of the list ids
+    # each user owns or has been shared
+
+    def __init__(self, maxsize=ACCESS_CACHE_SIZE, ttl=ACCESS_CACHE_TTL):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _load(self, user_id):
+        # From the primary even during GETs: the set is cached and then
+        # authorizes writes, and a lagging replica may still show a revoked
+        # share or miss a new one
+        list_ids = frozenset(db.session.scalars(access_query(user_id), bind_arguments={'bind': db.engine}))
+        self.cache.set(user_id, list_ids)
+        return list_ids
+
+    def list_ids(self, user_id):
+        list_ids = self.cache.get(user_id)
+        if list_ids is None:
+            list_ids = self._load(user_id)
+        return list_ids
+
+    def can_access(self, user_id, list_id):
+        if list_id in self.list_ids(user_id):
+            return True
+        # Shared by a request in another worker since we cached the set?
+        return list_id in self._load(user_id)
+
+    def invalidate(self, *user_ids):
+        for user_id in user_ids:
+            self.cache.delete(user_id)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+def get_access():
+    return current_app.extensions['access']
+
+
+def is_list_owner(user_id, grocery_list):
+    # Lists made through /add_list have no created_by; user_id is always set
+    return user_id in (grocery_list.user_id, grocery_list.created_by)
+
+
+def require_list_access(list_id):
+    if not get_access().can_access(session['user_id'], list_id):
+        abort(403)
+
+
+def list_access_required(f):
+    # For routes with a `list_id` argument; use after login_required
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        require_list_access(kwargs['list_id'])
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _pending(session):
+    return session.info.setdefault('access_invalidate', set())
+
+
+def _track_share(mapper, connection, target):
+    _pending(object_session(target)).add(target.user_id)
+
+
+def _track_list(mapper, connection, target):
+    _pending(object_session(target)).update({target.user_id, target.created_by} - {None})
+
+
+def init_app(app):
+    access = app.extensions['access'] = ListAccess()
+
+    # Forget a user's list set once a commit changes which lists they can see
+    for model, listener in ((ListShare, _track_share), (GroceryList, _track_list)):
+        event.listen(model, 'after_insert', listener)
+        event.listen(model, 'after_delete', listener)
+
+    @event.listens_for(Session, 'after_commit')
+    def _invalidate_after_commit(session):
+        user_ids = session.info.pop('access_invalidate', None)
+        if user_ids:
+            access.invalidate(*user_ids)
+
+    @event.listens_for(Session, 'after_rollback')
+    def _forget_after_rollback(session):
+        session.info.pop('access_invalidate', None)
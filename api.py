@@ -0,0 +1,280 @@
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, jsonify, request, session, stream_with_context, url_for
+from sqlalchemy import select
+from werkzeug.exceptions import HTTPException
+
+from access import get_access
+from archive import purchase_history
+from audit import UNDO_LIMIT, decode_event_cursor, list_events, list_state, undo
+from idempotency import request_idempotency_key
+from jobs import enqueue, job_to_dict
+from models import db, GroceryList, Job
+from mutations import MAX_BATCH_OPS, apply_item_ops
+from queries import (
+    ITEM_FIELDS,
+    LIST_FIELDS,
+    SHARE_FIELDS,
+    api_items_query,
+    api_lists_query,
+    api_shares_query,
+    decode_item_cursor,
+    item_cursor,
+)
+from search import SUGGESTION_LIMIT, get_item_search
+from summary import shopping_list
+from transfer import export_response, import_items, read_records, spool_upload, upload_format
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+DEFAULT_LIST_FIELDS = ('id', 'name', 'created_by', 'created_at', 'version', 'item_count', 'completed_count')
+DEFAULT_ITEM_FIELDS = ('id', 'version', 'name', 'quantity', 'completed', 'added_at', 'added_by')
+DEFAULT_SHARE_FIELDS = ('id', 'user_id', 'username')
+
+# Versioned so the mobile app can keep using v1 while the API evolves
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+@api.errorhandler(HTTPException)
+def _json_error(error):
+    return jsonify({'error': error.description}), error.code
+
+
+@api.before_request
+def _require_login():
+    if 'user_id' not in session:
+        abort(401, description='Login required')
+
+
+def _require_list(list_id):
+    if not get_access().can_access(session['user_id'], list_id):
+        abort(403, description='No access to this list')
+
+
+def _fields(available, default):
+    # ?fields=id,name picks the returned fields; unknown names are an error
+    if 'fields' not in request.args:
+        return default
+    fields = [name for name in request.args['fields'].split(',') if name]
+    unknown = [name for name in fields if name not in available]
+    if unknown or not fields:
+        abort(400, description=f"Unknown fields {', '.join(unknown)}; choose from {', '.join(available)}")
+    return fields
+
+
+def _limit():
+    limit = request.args.get('limit', API_PAGE_SIZE, type=int)
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        abort(400, description=f'limit must be between 1 and {API_MAX_PAGE_SIZE}')
+    return limit
+
+
+def _int_cursor():
+    if 'after' not in request.args:
+        return None
+    after = request.args.get('after', type=int)
+    if after is None:
+        abort(400, description='Invalid cursor')
+    return after
+
+
+def _since():
+    # ?since=2025-01-31 (or a full ISO timestamp) limits history to later purchases
+    if 'since' not in request.args:
+        return None
+    try:
+        return datetime.fromisoformat(request.args['since'])
+    except ValueError:
+        abort(400, description='since must be an ISO date')
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _rows_to_dicts(rows, fields):
+    return [{name: _value(row._mapping[name]) for name in fields} for row in rows]
+
+
+def _page(query, fields, limit, cursor):
+    # Runs a query built with limit + 1 and returns the API page envelope
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = cursor(rows[-1])
+    return jsonify({'data': _rows_to_dicts(rows, fields), 'next_cursor': next_cursor})
+
+
+@api.get('/lists')
+def lists():
+    fields, limit = _fields(LIST_FIELDS, DEFAULT_LIST_FIELDS), _limit()
+    query = api_lists_query(session['user_id'], fields, after=_int_cursor(), limit=limit)
+    return _page(query, fields, limit, lambda row: str(row.cursor_id))
+
+
+@api.get('/lists/<int:list_id>')
+def get_list(list_id):
+    _require_list(list_id)
+    fields = _fields(LIST_FIELDS, DEFAULT_LIST_FIELDS)
+    row = db.session.execute(api_lists_query(session['user_id'], fields, list_id=list_id)).first()
+    if row is None:
+        abort(404, description='List not found')
+    return jsonify({'data': _rows_to_dicts([row], fields)[0]})
+
+
+@api.get('/lists/<int:list_id>/items')
+def list_items(list_id):
+    _require_list(list_id)
+    fields, limit = _fields(ITEM_FIELDS, DEFAULT_ITEM_FIELDS), _limit()
+    after = None
+    if 'after' in request.args:
+        after = decode_item_cursor(request.args['after'])
+        if after is None:
+            abort(400, description='Invalid cursor')
+    query = api_items_query(list_id, fields, after=after, limit=limit)
+    return _page(query, fields, limit, lambda row: item_cursor(row.cursor_completed, row.cursor_added_at, row.cursor_id))
+
+
+@api.post('/lists/<int:list_id>/items')
+def change_items(list_id):
+    # Same operations as /list/<id>/items/batch: add, toggle, update, delete
+    _require_list(list_id)
+    ops = (request.get_json(silent=True) or {}).get('ops')
+    if not isinstance(ops, list) or not ops:
+        abort(400, description='Expected a non-empty ops list')
+    if len(ops) > MAX_BATCH_OPS:
+        abort(400, description=f'At most {MAX_BATCH_OPS} operations per batch')
+    results, version = apply_item_ops(list_id, session['user_id'], ops, idempotency_key=request_idempotency_key())
+    return jsonify({'results': results, 'version': version})
+
+
+@api.get('/lists/<int:list_id>/export')
+def export_items(list_id):
+    _require_list(list_id)
+    return export_response([list_id], request.args.get('format', 'json'), f'list-{list_id}')
+
+
+@api.post('/lists/<int:list_id>/import')
+def import_list_items(list_id):
+    # The body is a CSV or JSON (array or JSON Lines) document, read as it
+    # arrives. Progress comes back as JSON Lines, one per committed batch.
+    _require_list(list_id)
+    format = upload_format(mimetype=request.mimetype)
+    if format is None:
+        abort(415, description='Send text/csv, application/json or application/x-ndjson')
+    progress = import_items(list_id, session['user_id'], read_records(request.stream, format))
+    lines = (json.dumps(update) + '\n' for update in progress)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
+@api.post('/lists/<int:list_id>/imports')
+def start_import(list_id):
+    # Like /import, but the upload is saved and imported by a background
+    # job; poll the returned job for progress
+    _require_list(list_id)
+    format = upload_format(mimetype=request.mimetype)
+    if format is None:
+        abort(415, description='Send text/csv, application/json or application/x-ndjson')
+    path = spool_upload(request.stream, format)
+    job_id = enqueue('import-items', {
+        'list_id': list_id, 'user_id': session['user_id'], 'path': path, 'format': format,
+    }, user_id=session['user_id'])
+    response = jsonify({'data': job_to_dict(db.session.get(Job, job_id))})
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.get_job', job_id=job_id)
+    return response
+
+
+@api.get('/jobs/<int:job_id>')
+def get_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or job.user_id != session['user_id']:
+        abort(404, description='Job not found')
+    return jsonify({'data': job_to_dict(job)})
+
+
+@api.get('/items/search')
+def search_items():
+    # Autocomplete: names used on any of the user's lists, best match first
+    limit = request.args.get('limit', SUGGESTION_LIMIT, type=int)
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        abort(400, description=f'limit must be between 1 and {API_MAX_PAGE_SIZE}')
+    suggestions = get_item_search().search(session['user_id'], request.args.get('q', ''), limit)
+    response = jsonify({'data': suggestions})
+    # Retyping the same prefix shouldn't go back to the server
+    response.headers['Cache-Control'] = 'private, max-age=10'
+    return response
+
+
+@api.get('/shopping')
+def shopping():
+    # Open items across the user's lists, added up per name and unit
+    return jsonify({'data': shopping_list(sorted(get_access().list_ids(session['user_id'])))})
+
+
+@api.get('/history')
+def history():
+    # What the user's lists bought, most often first; reads only the archive
+    list_ids = sorted(get_access().list_ids(session['user_id']))
+    return jsonify({'data': purchase_history(list_ids, since=_since(), limit=_limit())})
+
+
+@api.get('/lists/<int:list_id>/history')
+def list_history(list_id):
+    _require_list(list_id)
+    return jsonify({'data': purchase_history([list_id], since=_since(), limit=_limit())})
+
+
+@api.get('/lists/<int:list_id>/audit')
+def list_audit(list_id):
+    # Who added, changed or removed what, newest first; ?item_id= narrows
+    # it to one item
+    _require_list(list_id)
+    limit = _limit()
+    after = None
+    if 'after' in request.args:
+        after = decode_event_cursor(request.args['after'])
+        if after is None:
+            abort(400, description='Invalid cursor')
+    events, next_cursor = list_events(list_id, request.args.get('item_id', type=int), after, limit)
+    return jsonify({'data': events, 'next_cursor': next_cursor})
+
+
+@api.get('/lists/<int:list_id>/versions/<int:version>')
+def list_version(list_id, version):
+    # The list's items as they were at `version`
+    _require_list(list_id)
+    current = db.session.scalar(select(GroceryList.version).where(GroceryList.id == list_id))
+    if current is None or version > current:
+        abort(404, description='No such version')
+    items = list_state(list_id, version)
+    if items is None:
+        abort(404, description="The list's history doesn't go back that far")
+    return jsonify({'data': {'version': version, 'items': items}})
+
+
+@api.post('/lists/<int:list_id>/undo')
+def undo_changes(list_id):
+    # Reverts the user's last `count` changes (default 1); results are in
+    # the same shape as /items, with conflicts for items changed since
+    _require_list(list_id)
+    count = (request.get_json(silent=True) or {}).get('count', 1)
+    if not isinstance(count, int) or not 1 <= count <= UNDO_LIMIT:
+        abort(400, description=f'count must be between 1 and {UNDO_LIMIT}')
+    results, version = undo(list_id, session['user_id'], count)
+    return jsonify({'results': results, 'version': version})
+
+
+@api.get('/lists/<int:list_id>/shares')
+def list_shares(list_id):
+    _require_list(list_id)
+    fields, limit = _fields(SHARE_FIELDS, DEFAULT_SHARE_FIELDS), _limit()
+    query = api_shares_query(list_id, fields, after=_int_cursor(), limit=limit)
+    return _page(query, fields, limit, lambda row: str(row.cursor_id))
+
+
+def init_app(app):
+    app.register_blueprint(api)
@@ -1,29 +1,110 @@
-from flask import Flask, flash, jsonify, render_template, request, redirect, url_for, session
-from flask_migrate import Migrate
+import time
+import_started = time.perf_counter()
+
+from flask import Flask, Response, abort, flash, jsonify, make_response, render_template, request, redirect, url_for, session
 from models import db, User, GroceryList, GroceryItem,ListShare
-from werkzeug.security import generate_password_hash, check_password_hash
+from queries import dashboard_lists, decode_item_cursor, item_to_dict, list_changes, list_items_page
+from mutations import MAX_BATCH_OPS, apply_item_ops
+import events
+import startup
+import query_plans
+import access
+from access import get_access, is_list_owner, list_access_required, require_list_access
+from idempotency import request_idempotency_key
+from passwords import get_password_hasher
+from ratelimit import limit_login
+import archive
+import audit
+import idempotency
+import jobs
+import passwords
+import purge
+import ratelimit
+import replicas
+import metrics
+import assets
+import fragments
+import search
+import summary
+import transfer
+import api
+import database
 from functools import wraps
-import firebase_admin
-from firebase_admin import credentials, auth as firebase_auth
-import os, json
+import click
+import os, json, threading
+
+startup_timer = startup.StartupTimer(import_started)
+startup_timer.mark('imports')
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
-
-migrate = Migrate(app, db)  # initialize migrate
-
-firebase_json = os.getenv("FIREBASE_CRED")
-cred_dict = json.loads(firebase_json)
-cred = credentials.Certificate(cred_dict)
-
-firebase_admin.initialize_app(cred)
-
-# Create DB
-with app.app_context():
+database.init_app(app)  # engine and pool settings from the environment
+replicas.init_app(app)  # reads from replicas, flask copy-to-replicas
+
+# Alembic is a large import that only the `flask db` commands need
+if os.getenv('FLASK_RUN_FROM_CLI'):
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)  # initialize migrate
+events.init_app(app)  # live list updates
+query_plans.init_app(app)  # flask check-query-plans
+access.init_app(app)  # cached list membership
+purge.init_app(app)  # background removal of deleted lists
+metrics.init_app(app)  # Server-Timing, /metrics and the slow-query log
+assets.init_app(app)  # fingerprinted static files, compressed responses
+fragments.init_app(app)  # cached dashboard cards and list rows
+search.init_app(app)  # item name autocomplete
+summary.init_app(app)  # flask rebuild-shopping-summary
+transfer.init_app(app)  # flask import-items
+api.init_app(app)  # JSON API under /api/v1
+idempotency.init_app(app)  # flask purge-idempotency-keys
+jobs.init_app(app)  # background jobs, flask run-jobs
+passwords.init_app(app)  # password hashing off the request thread
+ratelimit.init_app(app)  # sign-in attempt limits
+archive.init_app(app)  # purchase history, flask archive-completed
+audit.init_app(app)  # item change log, undo
+startup_timer.mark('extensions')
+
+
+firebase_lock = threading.Lock()
+
+
+def get_token_verifier():
+    # Firebase is only needed by /sessionLogin, so serverless cold starts
+    # don't pay for parsing credentials and initializing the SDK up front
+    verifier = app.extensions.get('firebase_tokens')
+    if verifier is not None:
+        return verifier
+    with firebase_lock:
+        verifier = app.extensions.get('firebase_tokens')
+        if verifier is not None:
+            return verifier
+
+        import firebase_admin
+        from firebase_admin import credentials
+        from firebase_tokens import TokenVerifier
+
+        cred_dict = json.loads(os.getenv("FIREBASE_CRED"))
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app(credentials.Certificate(cred_dict))
+
+        # ID tokens are checked locally against Google's cached signing keys
+        verifier = TokenVerifier(os.getenv('FIREBASE_PROJECT_ID') or cred_dict['project_id'])
+        app.extensions['firebase_tokens'] = verifier
+    return verifier
+
+
+# Schema creation is an explicit step rather than part of every cold start
+@app.cli.command('init-db')
+def init_db_command():
+    """Create all tables and mark the database as up to date with migrations."""
+    from flask_migrate import stamp
     db.create_all()
+    stamp()
+    click.echo('Database initialized.')
+
 
 # Login required decorator
 def login_required(f):
@@ -34,6 +115,13 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def get_list_or_404(list_id):
+    grocery_list = GroceryList.query.get_or_404(list_id)
+    if grocery_list.deleted_at is not None:
+        abort(404)
+    return grocery_list
+
+
 @app.route('/')
 def home():
     return redirect(url_for('login'))
@@ -42,9 +130,10 @@ def home():
 def register():
     if request.method == 'POST':
         username = request.form['username']
-        password = generate_password_hash(request.form['password'])
+        limit_login()
         if User.query.filter_by(username=username).first():
             return "User already exists"
+        password = get_password_hasher().hash(request.form['password'])
         new_user = User(username=username, password=password)
         db.session.add(new_user)
         db.session.commit()
@@ -54,8 +143,15 @@ def register():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
+        # Turn bursts away before paying for a hash
+        limit_login(request.form['username'])
         user = User.query.filter_by(username=request.form['username']).first()
-        if user and check_password_hash(user.password, request.form['password']):
+        matches, new_hash = get_password_hasher().verify(user and user.password, request.form['password'])
+        if matches:
+            if new_hash:
+                # Hashed with old parameters; upgrade while we have the password
+                user.password = new_hash
+                db.session.commit()
             session.permanent = True 
             session['user_id'] = user.id
             session['username'] = user.username
@@ -75,22 +171,27 @@ def session_login():
 
     try:
         # Verify Firebase ID token
-        decoded_token = firebase_auth.verify_id_token(id_token)
+        token_verifier = get_token_verifier()
+        decoded_token = token_verifier.verify(id_token)
         firebase_uid = decoded_token['uid']
         firebase_email = decoded_token.get('email')
 
         # Check if user exists by email
-        user = User.query.filter_by(email=firebase_email).first()
+        cached_user = token_verifier.users.get(firebase_email)
+        if cached_user is None:
+            user = User.query.filter_by(email=firebase_email).first()
+
+            # If user doesn't exist, create one with default username
+            if not user:
+                user = User(email=firebase_email, username=firebase_email.split('@')[0])
+                db.session.add(user)
+                db.session.commit()
 
-        # If user doesn't exist, create one with default username
-        if not user:
-            user = User(email=firebase_email, username=firebase_email.split('@')[0])
-            db.session.add(user)
-            db.session.commit()
+            cached_user = (user.id, user.username)
+            token_verifier.users.set(firebase_email, cached_user)
 
         # Set session
-        session['user_id'] = user.id
-        session['username'] = user.username
+        session['user_id'], session['username'] = cached_user
         return jsonify({'status': 'success'}), 200
 
     except Exception as e:
@@ -107,20 +208,32 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
+    # Owned and shared lists with their item counts, one page at a time
+    after = request.args.get('after', type=int)
     user_id = session['user_id']
+    lists, next_cursor = dashboard_lists(user_id, after=after)
+    cards = fragments.render_fragments('fragments/list_card.html', [
+        (fragments.list_card_key(row, user_id), row.version,
+         {'list': row, 'is_creator': row.created_by == user_id, 'is_owner': row.user_id == user_id})
+        for row in lists
+    ])
+
+    return render_template('dashboard.html', lists=lists, cards=cards, next_cursor=next_cursor)
 
-    # Lists created by user
-    created_lists = GroceryList.query.filter_by(user_id=user_id).all()
 
-    # Lists shared with user
-    shared_lists = GroceryList.query \
-        .join(ListShare, GroceryList.id == ListShare.list_id) \
-        .filter(ListShare.user_id == user_id).all()
+@app.route('/shopping')
+@login_required
+def shopping():
+    # Open items on every list the user can see, added up per name and unit
+    entries = summary.shopping_list(sorted(get_access().list_ids(session['user_id'])))
+    return render_template('shopping.html', entries=entries)
 
-    # Combine both
-    all_lists = created_lists + shared_lists
 
-    return render_template('dashboard.html', lists=all_lists)
+@app.route('/export')
+@login_required
+def export_lists():
+    list_ids = sorted(get_access().list_ids(session['user_id']))
+    return transfer.export_response(list_ids, request.args.get('format', 'csv'), 'grocery-lists')
 
 
 @app.route('/create_list', methods=['GET', 'POST'])
@@ -157,6 +270,7 @@ def add_list():
 
 @app.route("/list/<int:list_id>/add", methods=["POST"])
 @login_required
+@list_access_required
 def add_item(list_id):
     item_name = request.form.get("name")
     quantity = request.form.get("quantity")
@@ -164,26 +278,34 @@ def add_item(list_id):
     if not item_name or not quantity:
         return redirect(url_for("view_list", list_id=list_id))
 
-    new_item = GroceryItem(
-        name=item_name,
-        quantity=quantity,
-        list_id=list_id,
-        user_id=session["user_id"]
-    )
-    db.session.add(new_item)
-    db.session.commit()
+    apply_item_ops(list_id, session["user_id"], [{"op": "add", "name": item_name, "quantity": quantity}],
+                   idempotency_key=request_idempotency_key())
 
     # ✅ Redirect back to the same list page
     return redirect(url_for("view_list", list_id=list_id))
 
 
+def _item_preconditions(*names):
+    # Optional `completed` / `version` fields of a single-item JSON request
+    data = request.get_json(silent=True) or {}
+    return {name: data[name] for name in names if name in data}
+
+
 @app.route('/toggle_item/<int:item_id>', methods=["POST"])
 @login_required
 def toggle_item(item_id):
     item = GroceryItem.query.get_or_404(item_id)
-    item.completed = not item.completed
-    db.session.commit()
-    return jsonify({'success': True, 'completed': item.completed, 'list_id': item.list_id})
+    require_list_access(item.list_id)
+    # Clients should say which state they want; a bare toggle flips again
+    # when retried without an idempotency key
+    op = {'op': 'toggle', 'id': item.id, **_item_preconditions('completed', 'version')}
+    (result,), version = apply_item_ops(item.list_id, session['user_id'], [op],
+                                        idempotency_key=request_idempotency_key())
+    if not result['ok']:
+        return jsonify({'success': False, **result, 'list_id': item.list_id}), 409
+    # An item that was already in that state keeps its version
+    return jsonify({'success': True, 'completed': result['completed'], 'list_id': item.list_id,
+                    'version': result.get('version', version)})
 
 
 @app.route('/delete_item/<int:item_id>', methods=["POST"])
@@ -191,47 +313,188 @@ def toggle_item(item_id):
 def delete_item(item_id):
     item = GroceryItem.query.get_or_404(item_id)
     list_id = item.list_id
-    db.session.delete(item)
-    db.session.commit()
-    return jsonify({'success': True, 'list_id': list_id})
+    require_list_access(list_id)
+    op = {'op': 'delete', 'id': item.id, **_item_preconditions('version')}
+    (result,), version = apply_item_ops(list_id, session['user_id'], [op], idempotency_key=request_idempotency_key())
+    if not result['ok']:
+        return jsonify({'success': False, **result, 'list_id': list_id}), 409
+    return jsonify({'success': True, 'list_id': list_id, 'version': version})
+
+
+@app.route('/list/<int:list_id>/items/batch', methods=["POST"])
+@login_required
+@list_access_required
+def batch_items(list_id):
+    data = request.get_json(silent=True) or {}
+    ops = data.get('ops')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'error': 'Expected a non-empty ops list'}), 400
+    if len(ops) > MAX_BATCH_OPS:
+        return jsonify({'error': f'At most {MAX_BATCH_OPS} operations per batch'}), 400
+    results, version = apply_item_ops(list_id, session['user_id'], ops, idempotency_key=request_idempotency_key())
+    return jsonify({'success': True, 'results': results, 'version': version})
 
 
 @app.route('/list/<int:list_id>')
 @login_required
+@list_access_required
 def view_list(list_id):
-    grocery_list = GroceryList.query.get_or_404(list_id)
-    items = GroceryItem.query.filter_by(list_id=list_id).all()
-    return render_template('list.html', grocery_list=grocery_list, items=items)
+    grocery_list = get_list_or_404(list_id)
+
+    # The page only changes when the list version does (the user is part of
+    # the tag because the layout greets them by name), or when a deploy
+    # changes the fingerprinted asset URLs it links to
+    etag = f"list-{list_id}-v{grocery_list.version}-u{session['user_id']}-a{assets.get_manifest().digest}"
+    if request.if_none_match.contains_weak(etag) and not session.get('_flashes'):
+        response = app.response_class(status=304)
+    else:
+        # First page only; the rest is fetched from list_items as the user scrolls
+        items, next_cursor = list_items_page(list_id)
+        rows = fragments.render_fragments('fragments/item_row.html', [
+            (fragments.item_row_key(item.id), item.version, {'item': item}) for item in items
+        ])
+        response = make_response(render_template(
+            'list.html', grocery_list=grocery_list, items=items, rows=rows, next_cursor=next_cursor,
+        ))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/list/<int:list_id>/export')
+@login_required
+@list_access_required
+def export_list(list_id):
+    grocery_list = get_list_or_404(list_id)
+    return transfer.export_response([list_id], request.args.get('format', 'csv'), grocery_list.name)
+
+
+@app.route('/list/<int:list_id>/import', methods=['POST'])
+@login_required
+@list_access_required
+def import_list(list_id):
+    get_list_or_404(list_id)
+    upload = request.files.get('file')
+    format = upload and transfer.upload_format(upload.filename, upload.mimetype)
+    if not format:
+        flash('Choose a .csv or .json file to import', 'danger')
+        return redirect(url_for('view_list', list_id=list_id))
+
+    # Large files would outlast the request; items show up live as each
+    # batch is committed
+    path = transfer.spool_upload(upload.stream, format)
+    jobs.enqueue('import-items', {
+        'list_id': list_id, 'user_id': session['user_id'], 'path': path, 'format': format,
+    }, user_id=session['user_id'])
+    flash(f"Importing {upload.filename or 'the file'} in the background", 'info')
+    return redirect(url_for('view_list', list_id=list_id))
+
+
+@app.route('/list/<int:list_id>/clear_completed', methods=['POST'])
+@login_required
+@list_access_required
+def clear_completed(list_id):
+    get_list_or_404(list_id)
+    cleared = archive.clear_completed(list_id, session['user_id'])
+    flash(f'Moved {cleared} completed items to the purchase history', 'success')
+    return redirect(url_for('view_list', list_id=list_id))
+
+
+@app.route('/list/<int:list_id>/undo', methods=['POST'])
+@login_required
+@list_access_required
+def undo_last_change(list_id):
+    get_list_or_404(list_id)
+    results, version = audit.undo(list_id, session['user_id'])
+    if version is not None:
+        flash('Undid your last change', 'success')
+    elif results:
+        flash('Someone changed those items since; nothing was undone', 'danger')
+    else:
+        flash('Nothing to undo', 'info')
+    return redirect(url_for('view_list', list_id=list_id))
+
+
+@app.route('/list/<int:list_id>/changes')
+@login_required
+@list_access_required
+def list_changes_feed(list_id):
+    grocery_list = get_list_or_404(list_id)
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'Missing since version'}), 400
+    if since < grocery_list.tombstone_horizon:
+        # Deletions that far back were purged (see purge.TOMBSTONE_TTL)
+        return jsonify({'error': 'Changes that old are no longer kept; reload the list', 'reload': True}), 410
+    if since >= grocery_list.version:
+        return jsonify({'version': grocery_list.version, 'items': [], 'deleted': []})
+    items, deleted = list_changes(list_id, since)
+    return jsonify({
+        'version': grocery_list.version,
+        'items': [item_to_dict(item) for item in items],
+        'deleted': deleted,
+    })
+
+
+@app.route('/list/<int:list_id>/items')
+@login_required
+@list_access_required
+def list_items(list_id):
+    after = None
+    if 'after' in request.args:
+        after = decode_item_cursor(request.args['after'])
+        if after is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    items, next_cursor = list_items_page(list_id, after=after)
+    return jsonify({'items': [item_to_dict(item) for item in items], 'next_cursor': next_cursor})
+
+@app.route('/list/<int:list_id>/events')
+@login_required
+@list_access_required
+def list_events(list_id):
+    # Don't pin a pooled connection for the lifetime of the stream
+    db.session.close()
+    stream = events.stream_events(events.get_broker(), events.list_channel(list_id))
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 @app.route('/item/<int:item_id>/update', methods=["POST"])
 @login_required
 def update_item(item_id):
     item = GroceryItem.query.get_or_404(item_id)
+    require_list_access(item.list_id)
     data = request.get_json()
-    item.name = data['name']
-    item.quantity = data['quantity']
-    db.session.commit()
-    return jsonify({'success': True})
+    (result,), version = apply_item_ops(item.list_id, session['user_id'], [
+        {'op': 'update', 'id': item.id, 'name': data['name'], 'quantity': data['quantity'],
+         **_item_preconditions('version')}
+    ], idempotency_key=request_idempotency_key())
+    if result.get('error') == 'Conflict':
+        return jsonify({'success': False, **result}), 409
+    return jsonify({'success': result['ok'], 'version': version})
 
 
 @app.route('/delete_list/<int:list_id>')
 @login_required
 def delete_list(list_id):
-    grocery_list = GroceryList.query.get(list_id)
-    for item in grocery_list.items:
-        db.session.delete(item)
-    db.session.delete(grocery_list)
-    db.session.commit()
+    grocery_list = get_list_or_404(list_id)
+    if not is_list_owner(session['user_id'], grocery_list):
+        return "Unauthorized", 403
+    # Hide it now and remove the rows in the background, so a huge list
+    # doesn't hold the write lock for the length of this request
+    member_ids = purge.soft_delete_list(grocery_list)
+    get_access().invalidate(*member_ids)
+    fragments.invalidate_list(list_id)
     return redirect(url_for('dashboard'))
 
 
 @app.route('/list/<int:list_id>/share', methods=['GET', 'POST'])
 @login_required
 def share_list(list_id):
-    grocery_list = GroceryList.query.get_or_404(list_id)
+    grocery_list = get_list_or_404(list_id)
 
-    # ✅ FIXED: Use user_id instead of created_by
-    if grocery_list.user_id != session['user_id']:
+    if not is_list_owner(session['user_id'], grocery_list):
         return "Unauthorized", 403
 
     if request.method == 'POST':
@@ -265,9 +528,9 @@ def share_list(list_id):
 @app.route('/list/<int:list_id>/unshare/<int:user_id>', methods=['GET'])
 @login_required
 def unshare_list(list_id, user_id):  
-    grocery_list = GroceryList.query.get_or_404(list_id)
+    grocery_list = get_list_or_404(list_id)
     # Only the creator can unshare
-    if grocery_list.created_by != session['user_id']:
+    if not is_list_owner(session['user_id'], grocery_list):
         return "Unauthorized", 403
 
     # Prevent removing the creator themselves
@@ -286,5 +549,11 @@ def unshare_list(list_id, user_id):
     return redirect(url_for('share_list', list_id=list_id))
 
 
+startup_timer.mark('routes')
+startup.init_app(app, startup_timer)
+
 if __name__ == '__main__':
+    # Local development keeps the old create-on-start convenience
+    with app.app_context():
+        db.create_all()
     app.run(debug=True)
@@ -0,0 +1,109 @@
+import heapq
+import os
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, GroceryItem
+from mutations import MAX_BATCH_OPS, apply_item_ops, items_changed
+from quantities import format_quantity
+from queries import archive_due_query, purchase_history_query
+
+# Completed items are moved to the archive this many days after being
+# checked off; 0 leaves them until someone clears the list
+ARCHIVE_AFTER_DAYS = 30
+HISTORY_LIMIT = 100
+
+
+def archive_items(list_id, item_ids, user_id=None):
+    # Moves completed `item_ids` of one list to the archive, a batch of item
+    # operations at a time. Returns how many were archived.
+    item_ids = list(item_ids)
+    archived = 0
+    for start in range(0, len(item_ids), MAX_BATCH_OPS):
+        ops = [{'op': 'archive', 'id': item_id} for item_id in item_ids[start:start + MAX_BATCH_OPS]]
+        results, _ = apply_item_ops(list_id, user_id, ops)
+        archived += sum(result['ok'] for result in results)
+    return archived
+
+
+def clear_completed(list_id, user_id):
+    item_ids = db.session.scalars(
+        select(GroceryItem.id).where(GroceryItem.list_id == list_id, GroceryItem.completed.is_(True))
+    ).all()
+    return archive_items(list_id, item_ids, user_id)
+
+
+def archive_old_items(age, chunk_size=MAX_BATCH_OPS):
+    # Archives everything checked off more than `age` ago, oldest first.
+    # Returns how many items were archived.
+    cutoff = datetime.now(timezone.utc) - age
+    archived = 0
+    while True:
+        rows = db.session.execute(archive_due_query(cutoff, chunk_size)).all()
+        by_list = {}
+        for row in rows:
+            by_list.setdefault(row.list_id, []).append(row.id)
+        moved = sum(archive_items(list_id, item_ids) for list_id, item_ids in by_list.items())
+        archived += moved
+        if len(rows) < chunk_size or not moved:
+            return archived
+
+
+def archive_age(app=None):
+    # The background sweep's cutoff, or None when it's turned off
+    days = (app or current_app).config['ARCHIVE_AFTER_DAYS']
+    return timedelta(days=days) if days > 0 else None
+
+
+def purchase_history(list_ids, since=None, limit=HISTORY_LIMIT):
+    # What was bought from `list_ids`, most often first, e.g.
+    # {'name': 'Milk', 'purchases': 12, 'amounts': ['14 l'], 'every_days': 6.5, ...}
+    entries = {}
+    for row in db.session.execute(purchase_history_query(list_ids, since)):
+        entry = entries.get(row.name_key)
+        if entry is None:
+            entry = entries[row.name_key] = {
+                'name': row.name, 'purchases': 0, 'amounts': [],
+                'first_bought': row.first_bought, 'last_bought': row.last_bought,
+            }
+        if row.measured:
+            entry['amounts'].append(format_quantity(row.total, row.quantity_unit))
+        entry['purchases'] += row.purchases
+        entry['first_bought'] = min(entry['first_bought'], row.first_bought)
+        entry['last_bought'] = max(entry['last_bought'], row.last_bought)
+
+    history = heapq.nlargest(limit, entries.values(), key=lambda entry: (entry['purchases'], entry['last_bought']))
+    for entry in history:
+        # Average days between purchases
+        span = (entry['last_bought'] - entry['first_bought']).total_seconds() / 86400
+        entry['every_days'] = round(span / (entry['purchases'] - 1), 1) if entry['purchases'] > 1 else None
+        entry['first_bought'] = entry['first_bought'].isoformat()
+        entry['last_bought'] = entry['last_bought'].isoformat()
+    return history
+
+
+def _start_archiver(list_id, version, events, **extra):
+    # The purger's periodic sweep does the archiving; make sure it runs once
+    # there is something to archive
+    purger = current_app.extensions.get('purger')
+    if purger is not None and any(event['op'] == 'toggle' and event['completed'] for event in events):
+        purger.start()
+
+
+@click.command('archive-completed')
+@click.option('--days', type=int, help='Archive items completed this many days ago or earlier; '
+                                       'defaults to ARCHIVE_AFTER_DAYS.')
+def archive_completed_command(days):
+    """Move old completed items to the purchase history archive."""
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    click.echo(f'Archived {archive_old_items(timedelta(days=days))} items.')
+
+
+def init_app(app):
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', int(os.getenv('ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS)))
+    if archive_age(app) is not None:
+        items_changed.connect(_start_archiver)
+    app.cli.add_command(archive_completed_command)
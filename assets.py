@@ -0,0 +1,182 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+import click
+from flask import Response, abort, current_app, request, url_for
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Fingerprinted assets never change under the same URL
+IMMUTABLE = 'public, max-age=31536000, immutable'
+COMPRESSIBLE_TYPES = {'text/css', 'text/javascript', 'application/javascript', 'image/svg+xml', 'application/json'}
+COMPRESSIBLE_RESPONSES = {'text/html', 'application/json', 'text/plain'}
+MIN_COMPRESS_SIZE = 512
+
+
+def accepted_encoding():
+    encodings = request.accept_encodings
+    if brotli is not None and encodings['br']:
+        return 'br'
+    if encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, static=False):
+    # Assets are compressed once per process, so they get the slow, small
+    # settings; pages are compressed on every request
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else 5)
+    return gzip.compress(data, compresslevel=9 if static else 6, mtime=0)
+
+
+def fingerprint(filename, digest):
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}.{digest}{ext}'
+
+
+class AssetManifest:
+    # Maps files under static/ to content-hashed names and keeps their
+    # compressed bodies in memory. Built on first use; load(watch=True)
+    # re-hashes the files whenever one has changed (debug mode).
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.names = {}
+        self.files = {}
+        self.bodies = {}
+        # Changes whenever any fingerprint does; part of page ETags
+        self.digest = None
+        self._mtimes = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        mtimes = {}
+        for root, _, filenames in os.walk(self.folder):
+            for name in filenames:
+                path = os.path.join(root, name)
+                mtimes[os.path.relpath(path, self.folder).replace(os.sep, '/')] = os.stat(path).st_mtime_ns
+        return mtimes
+
+    def _build(self, mtimes):
+        names, files = {}, {}
+        for filename in mtimes:
+            with open(os.path.join(self.folder, filename), 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+            names[filename] = fingerprint(filename, digest)
+            files[names[filename]] = (filename, digest)
+        self.names, self.files, self.bodies = names, files, {}
+        self.digest = hashlib.sha256(' '.join(sorted(files)).encode()).hexdigest()[:12]
+        self._mtimes = mtimes
+
+    def load(self, watch=False):
+        if self._mtimes is not None and not watch:
+            return self
+        with self._lock:
+            mtimes = self._scan() if watch or self._mtimes is None else self._mtimes
+            if mtimes != self._mtimes:
+                self._build(mtimes)
+        return self
+
+    def url_name(self, filename):
+        return self.names.get(filename)
+
+    def resolve(self, fingerprinted):
+        # (filename, digest) for a current fingerprinted name, else None
+        return self.files.get(fingerprinted)
+
+    def body(self, filename, encoding):
+        key = (filename, encoding)
+        data = self.bodies.get(key)
+        if data is None:
+            with open(os.path.join(self.folder, filename), 'rb') as f:
+                data = f.read()
+            if encoding is not None:
+                data = compress(data, encoding, static=True)
+            self.bodies[key] = data
+        return data
+
+
+def get_manifest():
+    return current_app.extensions['assets'].load(watch=current_app.debug)
+
+
+def asset_url(filename):
+    # Template helper: the fingerprinted URL for a file under static/
+    name = get_manifest().url_name(filename)
+    if name is None:
+        return url_for('static', filename=filename)
+    return url_for('assets', filename=name)
+
+
+def serve_asset(filename):
+    manifest = get_manifest()
+    resolved = manifest.resolve(filename)
+    if resolved is None:
+        abort(404)
+    source, digest = resolved
+
+    mimetype = mimetypes.guess_type(source)[0] or 'application/octet-stream'
+    encoding = accepted_encoding() if mimetype in COMPRESSIBLE_TYPES else None
+    response = Response(status=200, mimetype=mimetype)
+    response.set_etag(digest)
+    response.headers['Cache-Control'] = IMMUTABLE
+    if mimetype in COMPRESSIBLE_TYPES:
+        response.vary.add('Accept-Encoding')
+    if request.if_none_match.contains_weak(digest):
+        response.status_code = 304
+        return response
+
+    response.set_data(manifest.body(source, encoding))
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def compress_response(response):
+    if (
+        response.mimetype not in COMPRESSIBLE_RESPONSES
+        or response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+        or response.status_code in (204, 304)
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    data = response.get_data()
+    if encoding is None or len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # The compressed body is a different byte sequence, so only a weak
+    # validator still holds
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+@click.command('asset-report')
+def asset_report_command():
+    """Print the fingerprinted name and compressed sizes of every static file."""
+    manifest = get_manifest()
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+    for filename, name in sorted(manifest.names.items()):
+        sizes = ', '.join(f'{enc} {len(manifest.body(filename, enc))}' for enc in encodings)
+        click.echo(f'{name}: {len(manifest.body(filename, None))} bytes ({sizes})')
+
+
+def init_app(app):
+    app.extensions['assets'] = AssetManifest(app.static_folder)
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+    app.add_template_global(asset_url)
+    app.after_request(compress_response)
+    app.cli.add_command(asset_report_command)
@@ -0,0 +1,346 @@
+import atexit
+import json
+import threading
+
+from flask import current_app
+from sqlalchemy import func, insert, or_, select, tuple_
+
+from models import db, User, GroceryList, GroceryItem, ItemEvent, ListSnapshot
+from mutations import apply_item_ops, items_changed
+
+# Buffered events are written at least this often, or as soon as this many
+# are waiting
+EVENT_FLUSH_SECONDS = 1
+EVENT_FLUSH_SIZE = 500
+# Events kept while the database can't be written; the oldest go first
+EVENT_BUFFER_LIMIT = 50000
+# A list gets a new snapshot once this many of its events were logged since
+# the last one, which bounds the replay needed to rebuild any version
+SNAPSHOT_EVERY = 100
+EVENT_PAGE_SIZE = 200
+UNDO_LIMIT = 50
+
+
+def _dump(state):
+    return json.dumps(state) if state is not None else None
+
+
+def _load(value):
+    return json.loads(value) if value is not None else None
+
+
+def snapshot_due_query(list_ids, every=SNAPSHOT_EVERY):
+    # Lists among `list_ids` without a snapshot, or with `every` events since
+    # their last one; only the events since then are counted
+    last = (
+        select(func.max(ListSnapshot.version)).where(ListSnapshot.list_id == GroceryList.id)
+        .correlate(GroceryList).scalar_subquery()
+    )
+    since = (
+        select(func.count()).select_from(ItemEvent)
+        .where(ItemEvent.list_id == GroceryList.id, ItemEvent.version > last)
+        .scalar_subquery()
+    )
+    return select(GroceryList.id).where(GroceryList.id.in_(list_ids), or_(last.is_(None), since >= every))
+
+
+def snapshot_items_query(list_id):
+    # One statement, so the items and the version agree
+    return (
+        select(GroceryList.version, GroceryItem.id, GroceryItem.name, GroceryItem.quantity, GroceryItem.completed)
+        .select_from(GroceryList)
+        .outerjoin(GroceryItem, GroceryItem.list_id == GroceryList.id)
+        .where(GroceryList.id == list_id)
+        .order_by(GroceryItem.id)
+    )
+
+
+def take_snapshot(list_id):
+    rows = db.session.execute(snapshot_items_query(list_id)).all()
+    if not rows:
+        return
+    items = [
+        {'id': row.id, 'name': row.name, 'quantity': row.quantity, 'completed': bool(row.completed)}
+        for row in rows if row.id is not None
+    ]
+    db.session.execute(insert(ListSnapshot).values(list_id=list_id, version=rows[0].version, items=json.dumps(items)))
+
+
+def _predates(row, created_at):
+    return created_at is not None and row['at'].replace(tzinfo=None) < created_at
+
+
+def write_events(rows):
+    # Lists purged while their events were buffered have nothing to log to,
+    # and on SQLite a new list can have taken a purged list's id since
+    list_ids = sorted({row['list_id'] for row in rows})
+    created = dict(db.session.execute(
+        select(GroceryList.id, GroceryList.created_at).where(GroceryList.id.in_(list_ids))
+    ).all())
+    rows = [row for row in rows if row['list_id'] in created and not _predates(row, created[row['list_id']])]
+    if rows:
+        db.session.execute(insert(ItemEvent), rows)
+        for list_id in db.session.scalars(snapshot_due_query(sorted({row['list_id'] for row in rows}))).all():
+            take_snapshot(list_id)
+    db.session.commit()
+
+
+class EventLog:
+    # Collects the changes of committed item batches and writes them to
+    # item_event from a background thread, many batches per INSERT, so a
+    # click doesn't pay for the log. Events show up within
+    # EVENT_FLUSH_SECONDS; the ones still buffered are lost if the process
+    # is killed.
+
+    def __init__(self, app, flush_seconds=EVENT_FLUSH_SECONDS, flush_size=EVENT_FLUSH_SIZE):
+        self.app = app
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def record(self, rows):
+        with self._lock:
+            self._pending.extend(rows)
+            full = len(self._pending) >= self.flush_size
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='event-log', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        # Writes everything buffered so far; returns how many events
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            try:
+                with self.app.app_context():
+                    write_events(rows)
+            except Exception:
+                with self._lock:
+                    self._pending = (rows + self._pending)[-EVENT_BUFFER_LIMIT:]
+                raise
+            return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Writing item events failed')
+
+
+def get_event_log():
+    return current_app.extensions['event_log']
+
+
+def _log_item_changes(list_id, version, events, user_id=None, at=None, changes=(), undo_of=None, **extra):
+    get_event_log().record([{
+        'list_id': list_id,
+        'version': version,
+        'item_id': change['id'],
+        'user_id': user_id,
+        'op': change['op'],
+        'at': at,
+        'before': _dump(change['before']),
+        'after': _dump(change['after']),
+        'undo_of': undo_of,
+    } for change in changes])
+
+
+def event_cursor(version, event_id):
+    return f'{version}~{event_id}'
+
+
+def decode_event_cursor(cursor):
+    # Returns None for anything that isn't a cursor we handed out
+    try:
+        version, event_id = cursor.split('~')
+        return int(version), int(event_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def list_events_query(list_id, item_id=None, after=None, limit=EVENT_PAGE_SIZE):
+    # Newest first; `after` is the (version, id) of the last event seen
+    order = (ItemEvent.version, ItemEvent.id)
+    query = (
+        select(
+            ItemEvent.id, ItemEvent.version, ItemEvent.op, ItemEvent.item_id, ItemEvent.user_id, User.username,
+            ItemEvent.at, ItemEvent.before, ItemEvent.after, ItemEvent.undo_of,
+        )
+        .outerjoin(User, User.id == ItemEvent.user_id)
+        .where(ItemEvent.list_id == list_id)
+    )
+    if item_id is not None:
+        query = query.where(ItemEvent.item_id == item_id)
+    if after is not None:
+        query = query.where(tuple_(*order) < tuple_(*after))
+    return query.order_by(*(column.desc() for column in order)).limit(limit)
+
+
+def user_events_query(list_id, user_id, after=None, limit=EVENT_PAGE_SIZE):
+    order = (ItemEvent.version, ItemEvent.id)
+    query = select(
+        ItemEvent.id, ItemEvent.version, ItemEvent.op, ItemEvent.item_id,
+        ItemEvent.before, ItemEvent.after, ItemEvent.undo_of,
+    ).where(ItemEvent.list_id == list_id, ItemEvent.user_id == user_id)
+    if after is not None:
+        query = query.where(tuple_(*order) < tuple_(*after))
+    return query.order_by(*(column.desc() for column in order)).limit(limit)
+
+
+def event_to_dict(row):
+    return {
+        'id': row.id,
+        'version': row.version,
+        'op': row.op,
+        'item_id': row.item_id,
+        'user_id': row.user_id,
+        'username': row.username,
+        'at': row.at.isoformat(),
+        'before': _load(row.before),
+        'after': _load(row.after),
+        'undo': row.undo_of is not None,
+    }
+
+
+def list_events(list_id, item_id=None, after=None, limit=EVENT_PAGE_SIZE):
+    # A page of the audit log, newest first, with the cursor for the next
+    rows = db.session.execute(list_events_query(list_id, item_id, after, limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = event_cursor(rows[-1].version, rows[-1].id)
+    return [event_to_dict(row) for row in rows], next_cursor
+
+
+def events_between_query(list_id, after_version, upto_version):
+    return (
+        select(ItemEvent.item_id, ItemEvent.before, ItemEvent.after)
+        .where(ItemEvent.list_id == list_id, ItemEvent.version > after_version, ItemEvent.version <= upto_version)
+        .order_by(ItemEvent.version, ItemEvent.id)
+    )
+
+
+def snapshot_query(list_id, version, later=False):
+    # The newest snapshot at or before `version`, or with `later` the
+    # oldest one after it
+    query = select(ListSnapshot.version, ListSnapshot.items).where(ListSnapshot.list_id == list_id)
+    if later:
+        return query.where(ListSnapshot.version > version).order_by(ListSnapshot.version).limit(1)
+    return query.where(ListSnapshot.version <= version).order_by(ListSnapshot.version.desc()).limit(1)
+
+
+def list_state(list_id, version):
+    # The list's items at `version`, replaying the log forwards from the
+    # snapshot before it or, failing that, backwards from the one after.
+    # None when the log doesn't go back that far.
+    snapshot = db.session.execute(snapshot_query(list_id, version)).first()
+    if snapshot is not None:
+        events = db.session.execute(events_between_query(list_id, snapshot.version, version)).all()
+        side = 'after'
+    else:
+        snapshot = db.session.execute(snapshot_query(list_id, version, later=True)).first()
+        first = db.session.scalar(select(func.min(ItemEvent.version)).where(ItemEvent.list_id == list_id))
+        if snapshot is None or first is None or version < first - 1:
+            return None
+        events = reversed(db.session.execute(events_between_query(list_id, version, snapshot.version)).all())
+        side = 'before'
+
+    items = {item['id']: item for item in json.loads(snapshot.items)}
+    for event in events:
+        state = _load(getattr(event, side))
+        if state is None:
+            items.pop(event.item_id, None)
+        else:
+            items[event.item_id] = {'id': event.item_id, **state}
+    return [items[item_id] for item_id in sorted(items)]
+
+
+def _user_events(list_id, user_id):
+    after = None
+    while True:
+        rows = db.session.execute(user_events_query(list_id, user_id, after)).all()
+        yield from rows
+        if len(rows) < EVENT_PAGE_SIZE:
+            return
+        after = (rows[-1].version, rows[-1].id)
+
+
+def undoable_events(list_id, user_id, count):
+    # Events of the user's last `count` batches on the list that haven't
+    # been undone, newest first. An undo reverts every earlier batch of the
+    # user from its undo_of version on, and can't be undone itself.
+    # Archiving isn't undone; the items are in the purchase history by then.
+    undone_from = None
+    versions, events = set(), []
+    for event in _user_events(list_id, user_id):
+        if event.undo_of is not None:
+            undone_from = event.undo_of if undone_from is None else min(undone_from, event.undo_of)
+            continue
+        if (undone_from is not None and event.version >= undone_from) or event.op == 'archive':
+            continue
+        if event.version not in versions:
+            if len(versions) == count:
+                break
+            versions.add(event.version)
+        events.append(event)
+    return events
+
+
+def inverse_ops(events):
+    # Item operations taking each item in `events` (newest first) back to
+    # before the oldest of them. Each carries the version the item had
+    # after the newest, so it's a conflict if anyone changed it since.
+    newest, oldest = {}, {}
+    for event in events:
+        newest.setdefault(event.item_id, event)
+        oldest[event.item_id] = event
+
+    ops = []
+    for item_id, last in newest.items():
+        current, target = _load(last.after), _load(oldest[item_id].before)
+        check = {'id': item_id, 'version': last.version}
+        if target is None:
+            if current is not None:
+                ops.append({'op': 'delete', **check})
+        elif current is None:
+            # Comes back as a new item
+            ops.append({'op': 'add', **target})
+        else:
+            if (target['name'], target['quantity']) != (current['name'], current['quantity']):
+                ops.append({'op': 'update', **check, 'name': target['name'], 'quantity': target['quantity']})
+            if target['completed'] != current['completed']:
+                ops.append({'op': 'toggle', **check, 'completed': target['completed']})
+    return ops
+
+
+def undo(list_id, user_id, count=1):
+    # Reverts the user's last `count` changes to the list (a batch of
+    # operations counts as one). Returns apply_item_ops' results and version.
+    log = get_event_log()
+    # The user's latest clicks may still be in this process's buffer
+    log.flush()
+    events = undoable_events(list_id, user_id, count)
+    ops = inverse_ops(events)
+    if not ops:
+        return [], None
+    results, version = apply_item_ops(list_id, user_id, ops, undo_of=min(event.version for event in events))
+    # Written now so the next undo, maybe in another process, skips these
+    log.flush()
+    return results, version
+
+
+def init_app(app):
+    log = app.extensions['event_log'] = EventLog(app)
+    atexit.register(log.flush)
+    items_changed.connect(_log_item_changes)
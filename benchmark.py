@@ -0,0 +1,571 @@
+"""Seeded load test and micro-benchmark for every route in app.py and api.py.
+
+    python benchmark.py                       # test client, compare to baseline
+    python benchmark.py --mode wsgi -t 8      # threaded WSGI server under load
+    python benchmark.py --save-baseline       # record a new baseline
+
+Runs against a throwaway SQLite database unless --database-url is given,
+and stands in a locally generated key pair for Firebase. The streaming
+/list/<id>/events route is left out: it never finishes by design. Before
+timing anything it checks that concurrent item batches on one list can't
+both apply against the same item version or skew the shopping summary.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+PASSWORD = 'bench-password'
+IMPORT_CSV = b'name,quantity\nmilk,1 l\nbread,1\neggs,12\n'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('client', 'wsgi'), default='client')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--lists-per-user', type=int, default=5)
+    parser.add_argument('--items-per-list', type=int, default=200)
+    parser.add_argument('--shares-per-list', type=int, default=2)
+    parser.add_argument('--iterations', type=int, default=50, help='Requests per route.')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per route first.')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='Concurrent clients in wsgi mode.')
+    parser.add_argument('--route', action='append', help='Only run these routes.')
+    parser.add_argument('--database-url', help='Use this (throwaway!) database instead of a temporary '
+                        'SQLite file. Its tables are dropped and reseeded.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='Allowed p50 slowdown (1.0 = twice as slow).')
+    parser.add_argument('--output', help='Also write the results as JSON here.')
+    return parser.parse_args()
+
+
+# Seeding
+
+def seed(db, models, args):
+    # Returns {user id: [ids of the lists they own]}
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+
+    from summary import parsed_quantity_values, rebuild_summary
+
+    User, GroceryList, GroceryItem, ListShare = models
+    rng = random.Random(args.seed)
+    password = generate_password_hash(PASSWORD)
+
+    def insert_many(model, rows):
+        return db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+
+    user_ids = insert_many(User, [
+        {'username': f'user{u}', 'email': f'user{u}@example.com', 'password': password}
+        for u in range(1, args.users + 1)
+    ])
+
+    owners = [u for u in user_ids for _ in range(args.lists_per_user)]
+    list_ids = insert_many(GroceryList, [
+        {'name': f'List {n}', 'user_id': owner, 'created_by': owner} for n, owner in enumerate(owners, 1)
+    ])
+
+    owned, shares, items = {u: [] for u in user_ids}, [], []
+    for list_id, owner in zip(list_ids, owners):
+        owned[owner].append(list_id)
+        others = [u for u in user_ids if u != owner]
+        for member in rng.sample(others, min(args.shares_per_list, len(others))):
+            shares.append({'list_id': list_id, 'user_id': member})
+        for n in range(args.items_per_list):
+            quantity = str(rng.randint(1, 5))
+            items.append({
+                'name': f'item {n}',
+                'quantity': quantity,
+                **parsed_quantity_values(quantity),
+                'list_id': list_id,
+                'user_id': owner,
+                'completed': rng.random() < 0.3,
+            })
+            if len(items) >= 5000:
+                db.session.execute(insert(GroceryItem), items)
+                items = []
+    if items:
+        db.session.execute(insert(GroceryItem), items)
+    if shares:
+        db.session.execute(insert(ListShare), shares)
+    db.session.commit()
+    # The bulk inserts above skip apply_item_ops
+    rebuild_summary()
+    return owned
+
+
+def install_firebase_stub(app):
+    # Sign ID tokens with a local key and make the verifier trust it
+    import datetime
+    import jwt
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+    from firebase_tokens import CertificateStore, TokenVerifier
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'benchmark')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    pem = cert.public_bytes(serialization.Encoding.PEM).decode()
+    project = 'benchmark'
+    certs = CertificateStore(fetch=lambda: ({'bench': pem}, 3600))
+    app.extensions['firebase_tokens'] = TokenVerifier(project, certs=certs)
+
+    def mint(email):
+        issued = int(time.time())
+        claims = {
+            'iss': f'https://securetoken.google.com/{project}', 'aud': project,
+            'sub': email, 'email': email, 'iat': issued, 'exp': issued + 3600,
+        }
+        return jwt.encode(claims, key, algorithm='RS256', headers={'kid': 'bench'})
+    return mint
+
+
+# Scenarios: each returns the request to time; any setup it does is untimed
+
+class Context:
+    def __init__(self, app, db, models, args, owned, mint):
+        self.app, self.db, self.args, self.owned, self.mint = app, db, args, owned, mint
+        self.User, self.GroceryList, self.GroceryItem, self.ListShare = models
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def unique(self):
+        with self.lock:
+            return next(self.counter)
+
+    def owned_list(self, user_id):
+        return self.owned[user_id][0]
+
+    def new_member(self):
+        n = self.unique()
+        return self.insert(self.User, username=f'member{n}', email=f'member{n}@example.com'), f'member{n}'
+
+    def insert(self, model, **values):
+        from sqlalchemy import insert
+        with self.app.app_context():
+            new_id = self.db.session.execute(insert(model).returning(model.id), [values]).scalar_one()
+            self.db.session.commit()
+        return new_id
+
+    def first_item(self, list_id):
+        from sqlalchemy import select
+        with self.app.app_context():
+            return self.db.session.scalar(
+                select(self.GroceryItem.id).where(self.GroceryItem.list_id == list_id)
+                .order_by(self.GroceryItem.id).limit(1)
+            )
+
+    def item_cursor(self, list_id):
+        with self.app.app_context():
+            from queries import list_items_page
+            _, cursor = list_items_page(list_id)
+        return cursor
+
+    def settle(self, timeout=5):
+        # Let background work started by warm-up requests finish, so the
+        # first timed item search doesn't still fall back to the database
+        search = self.app.extensions.get('search')
+        deadline = time.monotonic() + timeout
+        while search is not None and search._loading and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def items_page(self, list_id):
+        # The second page, or the first when the list fits on one
+        cursor = self.item_cursor(list_id)
+        return f'/list/{list_id}/items' + (f"?{urlencode({'after': cursor})}" if cursor else '')
+
+    def import_list(self, user_id):
+        # Imports add items; keep them off the list the other routes use
+        return self.owned[user_id][-1]
+
+    def with_completed_item(self, list_id, user_id):
+        # So each clear_completed has one item to archive
+        from datetime import datetime, timezone
+        self.insert(self.GroceryItem, name='tmp', quantity='1', list_id=list_id, user_id=user_id,
+                    completed=True, completed_at=datetime.now(timezone.utc))
+        return list_id
+
+    def with_change(self, list_id, user_id):
+        # So each undo has a change of user_id's to revert. Its events are
+        # written here, not by whichever of the request and the background
+        # flush gets to them first.
+        from mutations import apply_item_ops
+        item_id = self.first_item(list_id)
+        with self.app.app_context():
+            apply_item_ops(list_id, user_id, [{'op': 'toggle', 'id': item_id}])
+        self.app.extensions['event_log'].flush()
+        return list_id
+
+    def past_version(self, list_id, user_id):
+        # The version before a fresh change
+        from sqlalchemy import select
+        self.with_change(list_id, user_id)
+        with self.app.app_context():
+            return self.db.session.scalar(select(self.GroceryList.version).where(self.GroceryList.id == list_id)) - 1
+
+    def finished_job(self, user_id):
+        from models import Job
+        return self.insert(Job, kind='import-items', payload='{}', status='done', user_id=user_id)
+
+
+def get(path, status=200):
+    return {'method': 'GET', 'path': path, 'status': status}
+
+
+def post(path, status=200, data=None, json_body=None):
+    return {'method': 'POST', 'path': path, 'status': status, 'data': data, 'json': json_body}
+
+
+def post_body(path, body, content_type, status=200):
+    return {'method': 'POST', 'path': path, 'status': status, 'body': body, 'content_type': content_type}
+
+
+def upload(path, field, filename, body, content_type, status=200):
+    # A multipart form with one file, encoded up front so both runners send
+    # the same bytes
+    boundary = 'benchmark-boundary'
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n')
+    payload = head.encode() + body + f'\r\n--{boundary}--\r\n'.encode()
+    return post_body(path, payload, f'multipart/form-data; boundary={boundary}', status)
+
+
+def scenarios(ctx, user_id):
+    list_id = ctx.owned_list(user_id)
+    import_list_id = ctx.import_list(user_id)
+    return {
+        'home': lambda: get('/', 302),
+        'register (GET)': lambda: get('/register'),
+        'register': lambda: post('/register', 302, data={'username': f'new{ctx.unique()}', 'password': PASSWORD}),
+        'login (GET)': lambda: get('/login'),
+        'login': lambda: post('/login', 302, data={'username': f'user{user_id}', 'password': PASSWORD}),
+        'sessionLogin': lambda: post('/sessionLogin', json_body={'idToken': ctx.mint(f'user{user_id}@example.com')}),
+        'logout': lambda: get('/logout', 302),
+        'dashboard': lambda: get('/dashboard'),
+        'create_list (GET)': lambda: get('/create_list'),
+        'create_list': lambda: post('/create_list', 302, data={'name': 'Bench list'}),
+        'add_list': lambda: post('/add_list', 302, data={'list_name': 'Bench list'}),
+        'view_list': lambda: get(f'/list/{list_id}'),
+        'list_items': lambda: get(ctx.items_page(list_id)),
+        'list_changes': lambda: get(f'/list/{list_id}/changes?since=0'),
+        'add_item': lambda: post(f'/list/{list_id}/add', 302, data={'name': 'milk', 'quantity': '1'}),
+        'toggle_item': lambda: post(f'/toggle_item/{ctx.first_item(list_id)}'),
+        'update_item': lambda: post(f'/item/{ctx.first_item(list_id)}/update', json_body={'name': 'bread', 'quantity': '2'}),
+        'delete_item': lambda: post('/delete_item/{}'.format(
+            ctx.insert(ctx.GroceryItem, name='tmp', quantity='1', list_id=list_id, user_id=user_id))),
+        'batch_items': lambda: post(f'/list/{list_id}/items/batch', json_body={'ops': [
+            {'op': 'toggle', 'id': ctx.first_item(list_id)},
+            {'op': 'add', 'name': 'eggs', 'quantity': '12'},
+        ]}),
+        'delete_list': lambda: get('/delete_list/{}'.format(
+            ctx.insert(ctx.GroceryList, name='tmp', user_id=user_id, created_by=user_id)), 302),
+        'api lists': lambda: get('/api/v1/lists'),
+        'api list items': lambda: get(f'/api/v1/lists/{list_id}/items'),
+        'api list items (sparse)': lambda: get(f'/api/v1/lists/{list_id}/items?fields=id,name,completed'),
+        'api change items': lambda: post(f'/api/v1/lists/{list_id}/items', json_body={'ops': [
+            {'op': 'toggle', 'id': ctx.first_item(list_id)},
+        ]}),
+        'api item search': lambda: get('/api/v1/items/search?q=mi'),
+        'shopping': lambda: get('/shopping'),
+        'api shopping': lambda: get('/api/v1/shopping'),
+        'export_list': lambda: get(f'/list/{list_id}/export'),
+        'share_list (GET)': lambda: get(f'/list/{list_id}/share'),
+        'share_list': lambda: post(f'/list/{list_id}/share', 302, data={'username': ctx.new_member()[1]}),
+        'unshare_list': lambda: get('/list/{}/unshare/{}'.format(list_id, _share_target(ctx, list_id, user_id)), 302),
+        'export_lists': lambda: get('/export'),
+        'api export': lambda: get(f'/api/v1/lists/{list_id}/export'),
+        'clear_completed': lambda: post(f'/list/{ctx.with_completed_item(list_id, user_id)}/clear_completed', 302),
+        'undo': lambda: post(f'/list/{ctx.with_change(list_id, user_id)}/undo', 302),
+        'api undo': lambda: post(f'/api/v1/lists/{ctx.with_change(list_id, user_id)}/undo', json_body={}),
+        'api history': lambda: get('/api/v1/history'),
+        'api list history': lambda: get(f'/api/v1/lists/{list_id}/history'),
+        'api audit': lambda: get(f'/api/v1/lists/{list_id}/audit'),
+        'api list version': lambda: get(f'/api/v1/lists/{list_id}/versions/{ctx.past_version(list_id, user_id)}'),
+        'api job': lambda: get(f'/api/v1/jobs/{ctx.finished_job(user_id)}'),
+        'import_list': lambda: upload(f'/list/{import_list_id}/import', 'file', 'items.csv', IMPORT_CSV, 'text/csv', 302),
+        'api import': lambda: post_body(f'/api/v1/lists/{import_list_id}/import', IMPORT_CSV, 'text/csv'),
+        'api imports': lambda: post_body(f'/api/v1/lists/{import_list_id}/imports', IMPORT_CSV, 'text/csv', 202),
+    }
+
+
+def _share_target(ctx, list_id, owner):
+    # A fresh member on this list, so each unshare has something to remove
+    member, _ = ctx.new_member()
+    ctx.insert(ctx.ListShare, list_id=list_id, user_id=member)
+    return member
+
+
+# Runners
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed, queries=None):
+    latencies = sorted(samples)
+    summary = {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+    if queries is not None:
+        summary['queries'] = round(sum(queries) / len(queries), 2)
+    return summary
+
+
+def sign_in(app, user_id):
+    # A session cookie for user_id, without paying for a password check
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({'user_id': user_id, 'username': f'user{user_id}'})
+
+
+def run_client(ctx, routes):
+    from sqlalchemy import event
+
+    app, db = ctx.app, ctx.db
+    local = threading.local()
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_query(*args):
+        local.queries = getattr(local, 'queries', 0) + 1
+
+    results = {}
+    user_id = next(iter(ctx.owned))
+    client = app.test_client()
+    for name in routes:
+        samples, queries = [], []
+        for n in range(ctx.args.warmup + ctx.args.iterations):
+            if n == ctx.args.warmup:
+                ctx.settle()
+                samples, queries = [], []
+                started = time.perf_counter()
+            client.set_cookie(app.config['SESSION_COOKIE_NAME'], sign_in(app, user_id))
+            request = scenarios(ctx, user_id)[name]()
+            local.queries = 0
+            t0 = time.perf_counter()
+            if 'body' in request:
+                response = client.open(request['path'], method=request['method'],
+                                       data=request['body'], content_type=request['content_type'])
+            else:
+                response = client.open(request['path'], method=request['method'],
+                                       data=request.get('data'), json=request.get('json'))
+            # Streamed bodies are only produced as they're read
+            response.get_data()
+            samples.append((time.perf_counter() - t0) * 1000)
+            response.close()
+            queries.append(local.queries)
+            _check_status(name, response.status_code, request['status'])
+        results[name] = summarize(samples, time.perf_counter() - started, queries)
+    event.remove(engine, 'before_cursor_execute', count_query)
+    return results
+
+
+def run_wsgi(ctx, routes):
+    from werkzeug.serving import make_server
+
+    app = ctx.app
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+    cookie_name = app.config['SESSION_COOKIE_NAME']
+
+    def worker(name, user_id, count):
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        cookie = f'{cookie_name}={sign_in(app, user_id)}'
+        samples = []
+        for _ in range(count):
+            request = scenarios(ctx, user_id)[name]()
+            headers = {'Cookie': cookie}
+            body = None
+            if 'body' in request:
+                body = request['body']
+                headers['Content-Type'] = request['content_type']
+            elif request.get('json') is not None:
+                body = json.dumps(request['json'])
+                headers['Content-Type'] = 'application/json'
+            elif request.get('data') is not None:
+                body = urlencode(request['data'])
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            t0 = time.perf_counter()
+            connection.request(request['method'], request['path'], body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            samples.append((time.perf_counter() - t0) * 1000)
+            _check_status(name, response.status, request['status'])
+        connection.close()
+        return samples
+
+    results = {}
+    try:
+        all_users = list(ctx.owned)
+        users = [all_users[n % len(all_users)] for n in range(ctx.args.threads)]
+        per_thread = max(1, ctx.args.iterations // ctx.args.threads)
+        for name in routes:
+            worker(name, users[0], ctx.args.warmup)
+            ctx.settle()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(ctx.args.threads) as pool:
+                samples = list(itertools.chain.from_iterable(
+                    pool.map(lambda u: worker(name, u, per_thread), users)
+                ))
+            results[name] = summarize(samples, time.perf_counter() - started)
+    finally:
+        server.shutdown()
+    return results
+
+
+def _check_status(name, actual, expected):
+    if actual != expected:
+        raise SystemExit(f'{name}: expected HTTP {expected}, got {actual}')
+
+
+# Consistency
+
+def check_concurrent_batches(ctx, rounds=20):
+    # Two sessions send a batch for the same item version at the same moment;
+    # only one may apply, the other has to come back as a conflict, and the
+    # shopping summary has to agree with the items afterwards
+    from mutations import apply_item_ops
+    from summary import summary_mismatches
+
+    user_id = next(iter(ctx.owned))
+    list_id = ctx.insert(ctx.GroceryList, name='Race', user_id=user_id, created_by=user_id)
+    with ctx.app.app_context():
+        (result,), version = apply_item_ops(list_id, user_id, [{'op': 'add', 'name': 'milk', 'quantity': '1 l'}])
+    item_id = result['id']
+
+    def edit(name, barrier):
+        with ctx.app.app_context():
+            barrier.wait()
+            (result,), new_version = apply_item_ops(list_id, user_id, [
+                {'op': 'update', 'id': item_id, 'version': version, 'name': name, 'quantity': '1 l'},
+            ])
+            return result['ok'], new_version
+
+    for n in range(rounds):
+        barrier = threading.Barrier(2)
+        with ThreadPoolExecutor(2) as pool:
+            outcomes = list(pool.map(lambda name: edit(name, barrier), (f'oat milk {n}', f'soy milk {n}')))
+        applied = [new_version for ok, new_version in outcomes if ok]
+        if len(applied) != 1:
+            raise SystemExit(f'Concurrent batches: {len(applied)} of 2 applied to the same item version')
+        version = applied[0]
+    with ctx.app.app_context():
+        mismatches = summary_mismatches([list_id])
+    if mismatches:
+        raise SystemExit(f'Concurrent batches: shopping summary differs from the items: {mismatches}')
+
+
+# Reporting
+
+def print_table(results):
+    columns = ('requests', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries')
+    width = max(len(name) for name in results)
+    print(f"{'route':<{width}}  " + '  '.join(f'{c:>14}' for c in columns))
+    for name, row in results.items():
+        print(f'{name:<{width}}  ' + '  '.join(f"{row.get(c, '-'):>14}" for c in columns))
+
+
+def compare(results, baseline, tolerance):
+    # Query counts must not grow; the median may drift by `tolerance` (and
+    # 1ms, so sub-millisecond routes don't fail on noise). The tail is too
+    # noisy on shared machines to gate on, so p95/p99 are only reported.
+    regressions = []
+    for name, row in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if 'queries' in row and 'queries' in before and row['queries'] > before['queries']:
+            regressions.append(f"{name}: {row['queries']} queries per request, baseline {before['queries']}")
+        limit = before['p50_ms'] * (1 + tolerance) + 1.0
+        if row['p50_ms'] > limit:
+            regressions.append(f"{name}: p50 {row['p50_ms']}ms, baseline {before['p50_ms']}ms")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    tmpdir = tempfile.mkdtemp(prefix='grocery-bench-')
+    try:
+        run(args, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def run(args, tmpdir):
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+    from models import db, User, GroceryList, GroceryItem, ListShare
+
+    app.logger.disabled = True
+    # Every simulated client signs in as the same user from the same address
+    app.config['RATE_LIMITS_ENABLED'] = False
+    models = (User, GroceryList, GroceryItem, ListShare)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        t0 = time.perf_counter()
+        owned = seed(db, models, args)
+        print(f'Seeded in {time.perf_counter() - t0:.1f}s', file=sys.stderr)
+
+    ctx = Context(app, db, models, args, owned, install_firebase_stub(app))
+    check_concurrent_batches(ctx)
+    routes = args.route or list(scenarios(ctx, next(iter(owned))))
+    results = (run_client if args.mode == 'client' else run_wsgi)(ctx, routes)
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[args.mode] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return
+
+    regressions = compare(results, baselines.get(args.mode, {}), args.tolerance)
+    if regressions:
+        print('\nRegressions against baseline:', *regressions, sep='\n  ')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool
+
+from models import db
+from replicas import replica_binds, replica_urls
+
+DEFAULT_DATABASE_URL = 'sqlite:///app.db'
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_url():
+    url = os.getenv('DATABASE_URL', DEFAULT_DATABASE_URL)
+    # Supabase and Heroku hand out postgres:// URLs, which SQLAlchemy 2 rejects
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url):
+    if url.startswith('sqlite'):
+        return {}
+
+    options = {
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+        'connect_args': {'connect_timeout': _env_int('DB_CONNECT_TIMEOUT', 5)},
+    }
+    if os.getenv('DB_POOL_MODE', 'internal') == 'external':
+        # Serverless: an external pooler (Supabase's on port 6543, PgBouncer)
+        # owns the connections, so don't hold any between invocations
+        options['poolclass'] = NullPool
+    else:
+        options.update(
+            pool_size=_env_int('DB_POOL_SIZE', 5),
+            max_overflow=_env_int('DB_MAX_OVERFLOW', 10),
+            pool_timeout=_env_int('DB_POOL_TIMEOUT', 10),
+            pool_recycle=_env_int('DB_POOL_RECYCLE', 1800),
+        )
+    return options
+
+
+def sqlite_pragmas():
+    # WAL lets readers run alongside the single writer, and busy_timeout makes
+    # a blocked writer wait instead of failing with "database is locked"
+    return {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+    }
+
+
+def _apply_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    return on_connect
+
+
+def init_app(app):
+    # Configure Flask-SQLAlchemy from the environment (DATABASE_URL,
+    # DATABASE_REPLICA_URLS, DB_POOL_*, SQLITE_*) and initialize it
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', database_url())
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    app.config.setdefault('SQLALCHEMY_BINDS', {
+        key: {'url': url, **engine_options(url)} for key, url in replica_binds(replica_urls()).items()
+    })
+    db.init_app(app)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _apply_sqlite_pragmas(sqlite_pragmas()))
@@ -0,0 +1,225 @@
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from urllib.parse import urlparse
+
+import click
+from flask import current_app
+
+from mutations import items_changed
+
+HEARTBEAT_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# Handed to a subscriber that fell too far behind; it should resync from
+# the change feed instead of trusting the stream
+LAGGED = object()
+
+
+class Subscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.lagged = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.lagged = True
+
+    def get(self, timeout=None):
+        # Next message, None on timeout, or LAGGED once after an overflow
+        if self.lagged:
+            self.lagged = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return LAGGED
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    # Fan-out of JSON-serialisable messages to per-channel subscribers.
+    # Subclasses only change how published messages reach deliver().
+
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(s) for s in self._channels.values())
+
+    def deliver(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+
+class LocalBroker(Broker):
+    # Single process: publishing is delivering
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+
+class SocketBroker(Broker):
+    # Relays through an EventHub so every worker process sees every event.
+    # Messages only reach local subscribers once the hub echoes them back,
+    # which keeps ordering identical across workers.
+
+    def __init__(self, host, port):
+        super().__init__()
+        self.address = (host, port)
+        self._sock = None
+        self._send_lock = threading.Lock()
+        threading.Thread(target=self._read_forever, daemon=True).start()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def publish(self, channel, message):
+        line = json.dumps({'channel': channel, 'message': message}).encode() + b'\n'
+        with self._send_lock:
+            try:
+                if self._sock is None:
+                    self._sock = self._connect()
+                self._sock.sendall(line)
+            except OSError:
+                # Subscribers notice the gap by version and resync
+                self._sock = None
+
+    def _read_forever(self):
+        while True:
+            try:
+                with self._connect() as sock, sock.makefile('rb') as stream:
+                    for line in stream:
+                        envelope = json.loads(line)
+                        self.deliver(envelope['channel'], envelope['message'])
+            except (OSError, ValueError):
+                pass
+            time.sleep(1)
+
+
+class _HubHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        hub = self.server
+        with hub.clients_lock:
+            hub.clients.add(self.wfile)
+        try:
+            for line in self.rfile:
+                hub.broadcast(line)
+        finally:
+            with hub.clients_lock:
+                hub.clients.discard(self.wfile)
+
+
+class EventHub(socketserver.ThreadingTCPServer):
+    # Local stand-in for a shared pub/sub service: echoes every line it
+    # receives to every connected worker
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _HubHandler)
+        self.clients = set()
+        self.clients_lock = threading.Lock()
+
+    def broadcast(self, line):
+        with self.clients_lock:
+            clients = list(self.clients)
+        for wfile in clients:
+            try:
+                wfile.write(line)
+                wfile.flush()
+            except OSError:
+                pass
+
+
+def broker_from_url(url):
+    if not url or url == 'local://':
+        return LocalBroker()
+    parsed = urlparse(url)
+    if parsed.scheme == 'tcp':
+        return SocketBroker(parsed.hostname, parsed.port)
+    raise ValueError(f'Unsupported EVENT_BROKER_URL: {url}')
+
+
+def get_broker():
+    return current_app.extensions['events']
+
+
+def list_channel(list_id):
+    return f'list:{list_id}'
+
+
+def stream_events(broker, channel):
+    # Server-Sent Events body: one `change` event per committed batch,
+    # comments as heartbeats, `resync` if this subscriber overflowed
+    subscription = broker.subscribe(channel)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            message = subscription.get(timeout=HEARTBEAT_SECONDS)
+            if message is None:
+                yield ': ping\n\n'
+            elif message is LAGGED:
+                yield 'event: resync\ndata: {}\n\n'
+            else:
+                yield f"id: {message['version']}\nevent: change\ndata: {json.dumps(message)}\n\n"
+    finally:
+        subscription.close()
+
+
+def _publish_item_changes(list_id, version, events, **extra):
+    get_broker().publish(list_channel(list_id), {'version': version, 'events': events})
+
+
+@click.command('event-hub')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=7390, type=int)
+def event_hub_command(host, port):
+    """Relay list events between worker processes (EVENT_BROKER_URL=tcp://host:port)."""
+    with EventHub((host, port)) as hub:
+        click.echo(f'Event hub listening on {host}:{port}')
+        hub.serve_forever()
+
+
+def init_app(app):
+    app.config.setdefault('EVENT_BROKER_URL', os.getenv('EVENT_BROKER_URL'))
+    app.extensions['events'] = broker_from_url(app.config['EVENT_BROKER_URL'])
+    items_changed.connect(_publish_item_changes)
+    app.cli.add_command(event_hub_command)
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.request
+
+import jwt
+from cryptography.x509 import load_pem_x509_certificate
+
+from cache import TTLCache
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+DEFAULT_CERTS_TTL = 3600
+# An unknown `kid` may mean Google rotated keys early, but don't let bad
+# tokens make us refetch more than this often
+MIN_REFETCH_SECONDS = 60
+MAX_TOKEN_TTL = 600
+USER_CACHE_TTL = 600
+
+
+class InvalidIdToken(Exception):
+    pass
+
+
+def fetch_google_certs(url=GOOGLE_CERTS_URL, timeout=5):
+    # Returns ({kid: PEM certificate}, seconds the response may be cached)
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        certs = json.load(response)
+        match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    return certs, int(match.group(1)) if match else DEFAULT_CERTS_TTL
+
+
+class CertificateStore:
+    # Public keys of the token signer, refreshed when the fetcher's max-age runs out
+
+    def __init__(self, fetch=fetch_google_certs, clock=time.time):
+        self.fetch = fetch
+        self.clock = clock
+        self.fetches = 0
+        self._keys = {}
+        self._expires_at = 0
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self, now):
+        certs, max_age = self.fetch()
+        self._keys = {
+            kid: load_pem_x509_certificate(pem.encode()).public_key()
+            for kid, pem in certs.items()
+        }
+        self._expires_at = now + max_age
+        self._fetched_at = now
+        self.fetches += 1
+
+    def key(self, kid):
+        with self._lock:
+            now = self.clock()
+            if now >= self._expires_at:
+                self._refresh(now)
+            elif kid not in self._keys and now - self._fetched_at >= MIN_REFETCH_SECONDS:
+                self._refresh(now)
+            return self._keys.get(kid)
+
+
+class TokenVerifier:
+    # Verifies Firebase ID tokens the way firebase_admin.auth.verify_id_token
+    # does, but keeps signing keys and already-verified tokens in memory so a
+    # login burst costs one signature check per distinct token.
+
+    def __init__(self, project_id, certs=None, clock=time.time, max_tokens=10000):
+        self.project_id = project_id
+        self.issuer = f'https://securetoken.google.com/{project_id}'
+        self.certs = certs or CertificateStore(clock=clock)
+        self.clock = clock
+        self.tokens = TTLCache(maxsize=max_tokens, clock=clock)
+        # email -> (user id, username), for callers mapping tokens to local users
+        self.users = TTLCache(maxsize=max_tokens, ttl=USER_CACHE_TTL, clock=clock)
+
+    def verify(self, id_token):
+        cache_key = hashlib.sha256(id_token.encode()).digest()
+        claims = self.tokens.get(cache_key)
+        if claims is None:
+            claims = self._decode(id_token)
+            ttl = min(claims['exp'] - self.clock(), MAX_TOKEN_TTL)
+            if ttl > 0:
+                self.tokens.set(cache_key, claims, ttl=ttl)
+        return claims
+
+    def _decode(self, id_token):
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except jwt.PyJWTError as e:
+            raise InvalidIdToken(str(e)) from e
+        if header.get('alg') != 'RS256':
+            raise InvalidIdToken('Unexpected signing algorithm')
+
+        public_key = self.certs.key(header.get('kid'))
+        if public_key is None:
+            raise InvalidIdToken('Unknown signing key')
+
+        try:
+            claims = jwt.decode(
+                id_token,
+                public_key,
+                algorithms=['RS256'],
+                audience=self.project_id,
+                issuer=self.issuer,
+                options={'require': ['exp', 'iat', 'sub']},
+            )
+        except jwt.PyJWTError as e:
+            raise InvalidIdToken(str(e)) from e
+
+        if not isinstance(claims['sub'], str) or not claims['sub'] or len(claims['sub']) > 128:
+            raise InvalidIdToken('Invalid subject')
+        claims['uid'] = claims['sub']
+        return claims
+
+    def stats(self):
+        return {
+            'tokens': self.tokens.stats(),
+            'users': self.users.stats(),
+            'cert_fetches': self.certs.fetches,
+        }
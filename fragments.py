@@ -0,0 +1,208 @@
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+from mutations import items_changed
+
+# Bytes of rendered HTML kept per process
+FRAGMENT_CACHE_BYTES = 8 * 1024 * 1024
+
+
+class MemoryBackend:
+    # In-process LRU bounded by the total length of the cached strings
+
+    def __init__(self, maxbytes=FRAGMENT_CACHE_BYTES):
+        self.maxbytes = maxbytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._data.get(key)
+                if value is None:
+                    self.misses += 1
+                    continue
+                self._data.move_to_end(key)
+                self.hits += 1
+                found[key] = value
+        return found
+
+    def set_many(self, mapping):
+        with self._lock:
+            for key, value in mapping.items():
+                old = self._data.pop(key, None)
+                if old is not None:
+                    self.size -= len(old)
+                if len(value) > self.maxbytes:
+                    continue
+                self._data[key] = value
+                self.size += len(value)
+            while self.size > self.maxbytes:
+                _, old = self._data.popitem(last=False)
+                self.size -= len(old)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                old = self._data.pop(key, None)
+                if old is not None:
+                    self.size -= len(old)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'bytes': self.size}
+
+
+class SharedBackend:
+    # A store shared by every worker (Redis, memcached, ...). Subclasses
+    # implement the three bulk calls; keys and values are strings.
+
+    def get_many(self, keys):
+        raise NotImplementedError
+
+    def set_many(self, mapping):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        raise NotImplementedError
+
+
+class LocalSharedBackend(SharedBackend):
+    # Stand-in for a shared store within one process, e.g. for tests
+
+    def __init__(self):
+        self.data = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        with self._lock:
+            return {key: self.data[key] for key in keys if key in self.data}
+
+    def set_many(self, mapping):
+        with self._lock:
+            self.data.update(mapping)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+
+def shared_backend_from_url(url):
+    if not url:
+        return None
+    if url == 'local://':
+        return LocalSharedBackend()
+    raise ValueError(f'Unsupported FRAGMENT_CACHE_URL: {url}')
+
+
+class FragmentCache:
+    # Rendered HTML keyed by what it shows (`item-row:42`) and stamped with
+    # the version it was rendered at. A newer version reads as a miss, so a
+    # skipped invalidation can only cost memory, never serve stale HTML.
+    # Lookups go to the local LRU first and then to the shared backend.
+
+    def __init__(self, local=None, shared=None):
+        self.local = local or MemoryBackend()
+        self.shared = shared
+
+    def _pack(self, version, html):
+        return f'{version}:{html}'
+
+    def _unpack(self, value):
+        version, _, html = value.partition(':')
+        return int(version), html
+
+    def get_many(self, versions):
+        # {key: version} -> {key: html} for the keys cached at that version
+        found = {}
+        values = self.local.get_many(versions)
+        missing = [key for key in versions if key not in values]
+        if missing and self.shared is not None:
+            remote = self.shared.get_many(missing)
+            self.local.set_many(remote)
+            values.update(remote)
+        for key, value in values.items():
+            version, html = self._unpack(value)
+            if version == versions[key]:
+                found[key] = html
+        return found
+
+    def set_many(self, fragments):
+        # {key: (version, html)}
+        packed = {key: self._pack(version, html) for key, (version, html) in fragments.items()}
+        self.local.set_many(packed)
+        if self.shared is not None:
+            self.shared.set_many(packed)
+
+    def invalidate(self, *keys):
+        self.local.delete_many(keys)
+        if self.shared is not None:
+            self.shared.delete_many(keys)
+
+    def stats(self):
+        return self.local.stats()
+
+
+def get_fragment_cache():
+    return current_app.extensions['fragments']
+
+
+def item_row_key(item_id):
+    return f'item-row:{item_id}'
+
+
+def list_card_keys(list_id):
+    # The card differs for the creator and the owner (badge, buttons)
+    return [f'list-card:{list_id}:{creator:d}{owner:d}' for creator in (False, True) for owner in (False, True)]
+
+
+def list_card_key(list_row, user_id):
+    return f'list-card:{list_row.id}:{list_row.created_by == user_id:d}{list_row.user_id == user_id:d}'
+
+
+def render_fragments(template_name, entries):
+    # entries: (key, version, context) per fragment, in page order. Returns
+    # the HTML of each, rendering and caching only the misses. Misses go
+    # through render_template, so they get the context processors and count
+    # towards the request's render time like any page.
+    cache = get_fragment_cache()
+    found = cache.get_many({key: version for key, version, _ in entries})
+    template, rendered, fragments = None, {}, []
+    for key, version, context in entries:
+        html = found.get(key)
+        if html is None:
+            if template is None:
+                template = current_app.jinja_env.get_template(template_name)
+            html = render_template(template, **context)
+            rendered[key] = (version, html)
+        fragments.append(Markup(html))
+    if rendered:
+        cache.set_many(rendered)
+    return fragments
+
+
+def invalidate_list(list_id, item_ids=()):
+    get_fragment_cache().invalidate(*list_card_keys(list_id), *map(item_row_key, item_ids))
+
+
+def _invalidate_item_changes(list_id, version, events, **extra):
+    item_ids = [event['id'] for event in events if event['op'] != 'add']
+    invalidate_list(list_id, item_ids)
+
+
+def init_app(app):
+    app.config.setdefault('FRAGMENT_CACHE_BYTES', int(os.getenv('FRAGMENT_CACHE_BYTES', FRAGMENT_CACHE_BYTES)))
+    app.config.setdefault('FRAGMENT_CACHE_URL', os.getenv('FRAGMENT_CACHE_URL'))
+    app.extensions['fragments'] = FragmentCache(
+        MemoryBackend(app.config['FRAGMENT_CACHE_BYTES']),
+        shared_backend_from_url(app.config['FRAGMENT_CACHE_URL']),
+    )
+    items_changed.connect(_invalidate_item_changes)
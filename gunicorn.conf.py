@@ -0,0 +1,15 @@
+# gunicorn -c gunicorn.conf.py app:app
+# With more than one worker, run `flask event-hub` and set
+# EVENT_BROKER_URL=tcp://127.0.0.1:7390 so list events reach every worker.
+# Background jobs run on threads inside each worker unless JOBS_IN_PROCESS=0,
+# in which case run `flask run-jobs` alongside.
+import os
+
+# Greenlet workers so idle /list/<id>/events streams cost a socket and a
+# small stack rather than a thread each
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '2000'))
+# Streams send a heartbeat every 15s, well inside the timeout
+timeout = 60
+keepalive = 75
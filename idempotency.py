@@ -0,0 +1,100 @@
+import json
+import re
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import abort, current_app, request
+from sqlalchemy import delete, insert, select
+
+from models import db, IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# How long a retried request still gets the first response
+IDEMPOTENCY_TTL = timedelta(hours=24)
+EXPIRE_CHUNK_SIZE = 1000
+# A UUID, or any other short token the client likes
+KEY = re.compile(r'^[A-Za-z0-9_.:-]{1,64}$')
+
+
+def request_idempotency_key():
+    # From the Idempotency-Key header, or an `idempotency_key` field for
+    # plain form posts; None when the client didn't send one
+    key = request.headers.get(IDEMPOTENCY_HEADER) or request.form.get('idempotency_key')
+    if not key:
+        return None
+    if not KEY.match(key):
+        abort(400, description=f'{IDEMPOTENCY_HEADER} must be 1-64 letters, digits or _.:-')
+    return key
+
+
+def _aware(value):
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def stored_key_query(user_id, key):
+    return (
+        select(IdempotencyKey.id, IdempotencyKey.list_id, IdempotencyKey.created_at, IdempotencyKey.response)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+    )
+
+
+def stored_response(user_id, key, list_id):
+    # (results, version) saved for this key, or None if there isn't one
+    row = db.session.execute(stored_key_query(user_id, key)).first()
+    if row is None:
+        return None
+    if _aware(row.created_at) < datetime.now(timezone.utc) - IDEMPOTENCY_TTL:
+        # Not purged yet; let the key be used again
+        db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == row.id))
+        return None
+    if row.list_id != list_id:
+        abort(422, description=f'{IDEMPOTENCY_HEADER} was already used for another list')
+    results, version = json.loads(row.response)
+    return results, version
+
+
+def remember(user_id, key, list_id, results, version):
+    # Part of the batch's transaction; a concurrent duplicate fails the
+    # unique constraint instead of being applied twice
+    db.session.execute(insert(IdempotencyKey).values(
+        user_id=user_id,
+        key=key,
+        list_id=list_id,
+        created_at=datetime.now(timezone.utc),
+        response=json.dumps([results, version], separators=(',', ':')),
+    ))
+    # The purger expires old keys while it runs
+    purger = current_app.extensions.get('purger')
+    if purger is not None:
+        purger.start()
+
+
+def purge_expired_keys(chunk_size=EXPIRE_CHUNK_SIZE):
+    # Returns how many keys were removed
+    cutoff = datetime.now(timezone.utc) - IDEMPOTENCY_TTL
+    removed = 0
+    while True:
+        chunk = (
+            select(IdempotencyKey.id)
+            .where(IdempotencyKey.created_at < cutoff)
+            .limit(chunk_size)
+            .scalar_subquery()
+        )
+        result = db.session.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.id.in_(chunk)),
+            execution_options={'synchronize_session': False},
+        )
+        db.session.commit()
+        removed += result.rowcount
+        if result.rowcount < chunk_size:
+            return removed
+
+
+@click.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """Remove idempotency keys older than the retry window."""
+    click.echo(f'Removed {purge_expired_keys()} expired keys.')
+
+
+def init_app(app):
+    app.cli.add_command(purge_idempotency_keys_command)
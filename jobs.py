@@ -0,0 +1,258 @@
+import json
+import os
+import random
+import signal
+import threading
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from sqlalchemy import and_, or_, select, update
+
+from models import db, Job
+
+JOB_THREADS = 2
+# Seconds an idle worker thread sleeps before looking for due jobs again;
+# jobs enqueued by this process wake it right away
+JOB_POLL_INTERVAL = 5
+JOB_MAX_ATTEMPTS = 5
+# First retry delay in seconds, doubled for every further attempt
+JOB_RETRY_DELAY = 5
+JOB_MAX_RETRY_DELAY = 3600
+# A running job that hasn't reported progress for this long is assumed to
+# belong to a worker that died, and is queued again
+JOB_TIMEOUT = timedelta(minutes=15)
+
+# kind -> (function, max attempts). Functions take the JobContext and the
+# payload as keyword arguments, and return something JSON-serializable.
+JOB_KINDS = {}
+
+
+def job_kind(kind, max_attempts=JOB_MAX_ATTEMPTS):
+    def register(function):
+        JOB_KINDS[kind] = (function, max_attempts)
+        return function
+    return register
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def enqueue(kind, payload, user_id=None):
+    # Commits the job (and whatever else is pending in the session) and
+    # returns its id; `user_id` may poll its status
+    _, max_attempts = JOB_KINDS[kind]
+    job = Job(kind=kind, payload=json.dumps(payload), user_id=user_id, max_attempts=max_attempts, run_at=utcnow())
+    db.session.add(job)
+    db.session.flush()
+    # Read before committing, which would expire it
+    job_id = job.id
+    db.session.commit()
+    runner = current_app.extensions['jobs']
+    if runner.in_process:
+        runner.start()
+        runner.wake()
+    return job_id
+
+
+def job_files_dir(app=None):
+    # Uploads waiting for a job. Workers on other hosts need this on shared
+    # storage.
+    path = os.path.join((app or current_app).instance_path, 'job-files')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def retry_delay(attempts):
+    delay = min(JOB_RETRY_DELAY * 2 ** (attempts - 1), JOB_MAX_RETRY_DELAY)
+    # Jitter so jobs that failed together don't all retry together
+    return timedelta(seconds=delay * random.uniform(0.5, 1.5))
+
+
+def due_job_query(now):
+    # Any job ready to run, or abandoned by its worker
+    return select(Job.id).where(or_(
+        and_(Job.status == 'queued', Job.run_at <= now),
+        and_(Job.status == 'running', Job.locked_at < now - JOB_TIMEOUT),
+    )).limit(1)
+
+
+def claim_job_query(now):
+    due = (
+        select(Job.id)
+        .where(Job.status == 'queued', Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return (
+        update(Job)
+        .where(Job.id == due, Job.status == 'queued')
+        .values(status='running', locked_at=now, attempts=Job.attempts + 1)
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+    )
+
+
+def stale_jobs_query(now):
+    return (
+        update(Job)
+        .where(Job.status == 'running', Job.locked_at < now - JOB_TIMEOUT)
+        .values(status='queued', run_at=now)
+    )
+
+
+class JobContext:
+    # What a job function gets to report progress with
+
+    def __init__(self, job_id, attempts, max_attempts):
+        self.id = job_id
+        self.attempts = attempts
+        self.last_attempt = attempts >= max_attempts
+
+    def progress(self, values):
+        # Shown by the status endpoint; also tells other workers this job
+        # is still alive
+        db.session.execute(
+            update(Job).where(Job.id == self.id).values(result=json.dumps(values), locked_at=utcnow())
+        )
+        db.session.commit()
+
+
+def _finish(job_id, **values):
+    db.session.execute(update(Job).where(Job.id == job_id, Job.status == 'running').values(**values))
+    db.session.commit()
+
+
+def run_next_job(logger):
+    # Claims and runs one due job; False when there was none
+    now = utcnow()
+    # Idle polls only read, so they don't queue up for SQLite's write lock
+    if db.session.scalar(due_job_query(now)) is None:
+        db.session.rollback()
+        return False
+    claimed = db.session.execute(claim_job_query(now)).first()
+    if claimed is None and db.session.execute(stale_jobs_query(now)).rowcount:
+        claimed = db.session.execute(claim_job_query(now)).first()
+    db.session.commit()
+    if claimed is None:
+        return False
+
+    if claimed.kind not in JOB_KINDS:
+        _finish(claimed.id, status='failed', error=f'Unknown job kind {claimed.kind}', finished_at=utcnow())
+        return True
+    function, _ = JOB_KINDS[claimed.kind]
+    context = JobContext(claimed.id, claimed.attempts, claimed.max_attempts)
+    try:
+        result = function(context, **json.loads(claimed.payload))
+    except Exception as error:
+        db.session.rollback()
+        logger.exception('Job %s (%s) failed on attempt %s', claimed.id, claimed.kind, claimed.attempts)
+        if context.last_attempt:
+            _finish(claimed.id, status='failed', error=repr(error), finished_at=utcnow())
+        else:
+            _finish(claimed.id, status='queued', error=repr(error), run_at=utcnow() + retry_delay(claimed.attempts))
+    else:
+        _finish(claimed.id, status='done', result=json.dumps(result), error=None, finished_at=utcnow())
+    return True
+
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class JobRunner:
+    # A pool of threads that each claim and run one job at a time. Started
+    # by `flask run-jobs`, or lazily inside the web process when
+    # JOBS_IN_PROCESS is on.
+
+    def __init__(self, app, threads=JOB_THREADS, in_process=False):
+        self.app = app
+        self.threads = threads
+        self.in_process = in_process
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            for n in range(len(self._workers), self.threads):
+                worker = threading.Thread(target=self._run, name=f'job-worker-{n}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def run_pending(self):
+        # Runs due jobs on the calling thread until there are none left
+        count = 0
+        with self.app.app_context():
+            while run_next_job(self.app.logger):
+                count += 1
+        return count
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    ran = run_next_job(self.app.logger)
+            except Exception:
+                self.app.logger.exception('Job worker error')
+                ran = False
+            if not ran:
+                self._wake.wait(JOB_POLL_INTERVAL)
+                self._wake.clear()
+
+
+def get_job_runner():
+    return current_app.extensions['jobs']
+
+
+@click.command('run-jobs')
+@click.option('--threads', default=JOB_THREADS, type=int, help='Jobs run at the same time.')
+@click.option('--once', is_flag=True, help='Run the jobs that are due, then exit.')
+def run_jobs_command(threads, once):
+    """Run queued background jobs until interrupted."""
+    app = current_app._get_current_object()
+    runner = JobRunner(app, threads=threads)
+    if once:
+        click.echo(f'Ran {runner.run_pending()} jobs.')
+        return
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+    runner.start()
+    click.echo(f'Running jobs on {threads} threads; Ctrl+C to stop.')
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    # Jobs cut short here are picked up again after JOB_TIMEOUT
+    runner.stop(timeout=30)
+
+
+def init_app(app):
+    app.config.setdefault('JOB_THREADS', int(os.getenv('JOB_THREADS', JOB_THREADS)))
+    # Off when `flask run-jobs` runs as its own process
+    app.config.setdefault('JOBS_IN_PROCESS', os.getenv('JOBS_IN_PROCESS', '1').lower() in ('1', 'true', 'yes', 'on'))
+    app.extensions['jobs'] = JobRunner(app, app.config['JOB_THREADS'], app.config['JOBS_IN_PROCESS'])
+    app.cli.add_command(run_jobs_command)
@@ -0,0 +1,237 @@
+import hmac
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db
+
+# Upper bounds in seconds for the request latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOPBACK_ADDRS = ('127.0.0.1', '::1')
+
+slow_query_log = logging.getLogger('slow_queries')
+
+
+class RequestStats:
+    # What one request spent on SQL and templates
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.lazy_loads = 0
+        self.sql_time = 0.0
+        self.slowest_query = 0.0
+        self.render_time = 0.0
+        self.render_started = []
+
+    def add_query(self, duration):
+        self.queries += 1
+        self.sql_time += duration
+        self.slowest_query = max(self.slowest_query, duration)
+
+    def server_timing(self, duration):
+        ms = lambda seconds: round(seconds * 1000, 2)
+        return ', '.join((
+            f'db;desc="{self.queries} queries";dur={ms(self.sql_time)}',
+            f'db-slowest;dur={ms(self.slowest_query)}',
+            f'lazy-loads;desc="{self.lazy_loads}"',
+            f'render;dur={ms(self.render_time)}',
+            f'total;dur={ms(duration)}',
+        ))
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.requests = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.lazy_loads = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+
+
+class MetricsRegistry:
+    # Per-endpoint totals for this process. Every gunicorn worker keeps its
+    # own, so Prometheus should scrape the workers rather than the balancer
+    # or treat each scrape as a sample from one worker.
+
+    def __init__(self):
+        self.endpoints = {}
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, status, duration, stats):
+        with self._lock:
+            metrics = self.endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self.endpoints[endpoint] = EndpointMetrics()
+            metrics.bucket_counts[bisect_left(LATENCY_BUCKETS, duration)] += 1
+            metrics.requests += 1
+            metrics.duration += duration
+            metrics.queries += stats.queries
+            metrics.lazy_loads += stats.lazy_loads
+            metrics.sql_time += stats.sql_time
+            metrics.render_time += stats.render_time
+            key = (endpoint, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def render(self, gauges=()):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            statuses = sorted(self.statuses.items())
+
+            family('http_request_duration_seconds', 'histogram', 'Request latency by endpoint.')
+            for endpoint, metrics in endpoints:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), metrics.bucket_counts):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {metrics.duration:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{endpoint="{endpoint}"}} {metrics.requests}')
+
+            family('http_responses_total', 'counter', 'Responses by endpoint and status code.')
+            for (endpoint, status), count in statuses:
+                lines.append(f'http_responses_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+            for name, attr, help_text in (
+                ('db_queries_total', 'queries', 'SQL statements executed while handling requests.'),
+                ('db_lazy_loads_total', 'lazy_loads', 'Relationships lazy-loaded while handling requests.'),
+                ('db_query_seconds_total', 'sql_time', 'Time spent executing SQL while handling requests.'),
+                ('template_render_seconds_total', 'render_time', 'Time spent rendering Jinja templates.'),
+            ):
+                family(name, 'counter', help_text)
+                for endpoint, metrics in endpoints:
+                    value = getattr(metrics, attr)
+                    value = f'{value:.6f}' if isinstance(value, float) else value
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {value}')
+
+        for name, help_text, values in gauges:
+            family(name, 'gauge', help_text)
+            for labels, value in values:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f'{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _request_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+
+def _cache_gauges(app):
+    # Hit/miss counts of the in-process caches, where they've been set up
+    caches = {}
+    if 'access' in app.extensions:
+        caches['access'] = app.extensions['access'].stats()
+    if 'fragments' in app.extensions:
+        caches['fragments'] = app.extensions['fragments'].stats()
+    verifier = app.extensions.get('firebase_tokens')
+    if verifier is not None:
+        stats = verifier.stats()
+        caches['firebase_tokens'] = stats['tokens']
+        caches['firebase_users'] = stats['users']
+    return [
+        (f'cache_{key}', f'In-process cache {key}.', [({'cache': name}, stats[key]) for name, stats in caches.items()])
+        for key in ('hits', 'misses', 'size')
+    ]
+
+
+def _check_metrics_token():
+    # With METRICS_TOKEN set, /metrics needs `Authorization: Bearer <token>`.
+    # Without it, only a scraper on this host gets in (a request relayed by
+    # a local proxy doesn't count), unless METRICS_PUBLIC opens it to all.
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+    elif not current_app.config['METRICS_PUBLIC']:
+        if request.remote_addr not in LOOPBACK_ADDRS or 'X-Forwarded-For' in request.headers:
+            abort(403)
+
+
+def metrics_view():
+    _check_metrics_token()
+    app = current_app._get_current_object()
+    body = app.extensions['metrics'].render(_cache_gauges(app))
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def _install_engine_hooks(app, engine):
+    threshold = app.config['SLOW_QUERY_MS']
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _query_finished(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context._metrics_started
+        stats = _request_stats()
+        if stats is not None:
+            stats.add_query(duration)
+        if threshold is not None and duration * 1000 >= threshold:
+            slow_query_log.warning(
+                'Slow query (%.1fms) on %s: %s %.200r', duration * 1000,
+                request.endpoint if has_request_context() else '-', statement, parameters,
+            )
+
+
+def init_app(app):
+    # SLOW_QUERY_MS unset means no slow-query log
+    slow_query_ms = os.getenv('SLOW_QUERY_MS')
+    app.config.setdefault('SLOW_QUERY_MS', float(slow_query_ms) if slow_query_ms else None)
+    app.config.setdefault('METRICS_TOKEN', os.getenv('METRICS_TOKEN'))
+    app.config.setdefault('METRICS_PUBLIC', os.getenv('METRICS_PUBLIC', '0').lower() in ('1', 'true', 'yes', 'on'))
+    registry = app.extensions['metrics'] = MetricsRegistry()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            _install_engine_hooks(app, engine)
+
+    @event.listens_for(Session, 'do_orm_execute')
+    def _count_lazy_load(orm_execute_state):
+        stats = _request_stats()
+        if stats is not None and orm_execute_state.is_relationship_load:
+            stats.lazy_loads += 1
+
+    def _render_started(sender, template, context, **extra):
+        stats = _request_stats()
+        if stats is not None:
+            stats.render_started.append(time.perf_counter())
+
+    def _render_finished(sender, template, context, **extra):
+        stats = _request_stats()
+        if stats is not None and stats.render_started:
+            stats.render_time += time.perf_counter() - stats.render_started.pop()
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
+
+    @app.before_request
+    def _start_request_stats():
+        g.request_stats = RequestStats()
+
+    @app.after_request
+    def _record_request_stats(response):
+        stats = g.pop('request_stats', None)
+        # A streamed body (/list/<id>/events) is sent after this runs and
+        # isn't counted
+        if stats is not None and request.endpoint != 'metrics':
+            duration = time.perf_counter() - stats.started
+            response.headers.add('Server-Timing', stats.server_timing(duration))
+            registry.observe(request.endpoint or 'unmatched', response.status_code, duration, stats)
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,60 @@
+"""Add item name search index
+
+Revision ID: c74404ce4eb5
+Revises: 1a5ad325b28b
+Create Date: 2026-10-18 12:58:03.412907
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c74404ce4eb5'
+down_revision = '1a5ad325b28b'
+branch_labels = None
+depends_on = None
+
+
+# Same statements as search.py, copied so this migration doesn't change
+# when the app does
+SQLITE_UPGRADE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS grocery_item_fts USING fts5("
+    "name, content='grocery_item', content_rowid='id', prefix='2 3', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS grocery_item_fts_insert AFTER INSERT ON grocery_item BEGIN "
+    "INSERT INTO grocery_item_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS grocery_item_fts_delete AFTER DELETE ON grocery_item BEGIN "
+    "INSERT INTO grocery_item_fts(grocery_item_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS grocery_item_fts_update AFTER UPDATE OF name ON grocery_item BEGIN "
+    "INSERT INTO grocery_item_fts(grocery_item_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO grocery_item_fts(rowid, name) VALUES (new.id, new.name); END",
+    # Index the items that already exist
+    "INSERT INTO grocery_item_fts(grocery_item_fts) VALUES ('rebuild')",
+)
+SQLITE_DOWNGRADE = (
+    'DROP TRIGGER IF EXISTS grocery_item_fts_update',
+    'DROP TRIGGER IF EXISTS grocery_item_fts_delete',
+    'DROP TRIGGER IF EXISTS grocery_item_fts_insert',
+    'DROP TABLE IF EXISTS grocery_item_fts',
+)
+POSTGRES_UPGRADE = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_grocery_item_name_trgm ON grocery_item USING gin (name gin_trgm_ops)',
+)
+POSTGRES_DOWNGRADE = (
+    'DROP INDEX IF EXISTS ix_grocery_item_name_trgm',
+)
+
+
+def _run(sqlite, postgres):
+    dialect = op.get_bind().dialect.name
+    for statement in {'sqlite': sqlite, 'postgresql': postgres}.get(dialect, ()):
+        op.execute(statement)
+
+
+def upgrade():
+    _run(SQLITE_UPGRADE, POSTGRES_UPGRADE)
+
+
+def downgrade():
+    _run(SQLITE_DOWNGRADE, POSTGRES_DOWNGRADE)
@@ -0,0 +1,59 @@
+"""Never reuse item ids on SQLite
+
+Revision ID: e81b4f2a6d07
+Revises: c97bd07d4e2f
+Create Date: 2026-10-18 14:41:09.218364
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b4f2a6d07'
+down_revision = 'c97bd07d4e2f'
+branch_labels = None
+depends_on = None
+
+
+# Recreating grocery_item drops the search index triggers; same statements
+# as search.py, copied so this migration doesn't change when the app does
+SQLITE_SEARCH_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS grocery_item_fts_insert AFTER INSERT ON grocery_item BEGIN "
+    "INSERT INTO grocery_item_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS grocery_item_fts_delete AFTER DELETE ON grocery_item BEGIN "
+    "INSERT INTO grocery_item_fts(grocery_item_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS grocery_item_fts_update AFTER UPDATE OF name ON grocery_item BEGIN "
+    "INSERT INTO grocery_item_fts(grocery_item_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO grocery_item_fts(rowid, name) VALUES (new.id, new.name); END",
+)
+# Ids of items deleted before the upgrade may be above the highest one left,
+# and the event log and tombstones still refer to them
+SQLITE_SEED_SEQUENCE = (
+    "DELETE FROM sqlite_sequence WHERE name = 'grocery_item'",
+    "INSERT INTO sqlite_sequence (name, seq) SELECT 'grocery_item', max("
+    "coalesce((SELECT max(id) FROM grocery_item), 0), "
+    "coalesce((SELECT max(item_id) FROM item_event), 0), "
+    "coalesce((SELECT max(item_id) FROM item_tombstone), 0))",
+)
+
+
+def _recreate_items(autoincrement):
+    # Other databases never reuse generated ids
+    if op.get_bind().dialect.name != 'sqlite':
+        return False
+    with op.batch_alter_table('grocery_item', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': autoincrement}):
+        pass
+    for statement in SQLITE_SEARCH_TRIGGERS:
+        op.execute(statement)
+    return True
+
+
+def upgrade():
+    if _recreate_items(True):
+        for statement in SQLITE_SEED_SEQUENCE:
+            op.execute(statement)
+
+
+def downgrade():
+    _recreate_items(False)
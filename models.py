@@ -3,7 +3,9 @@ from datetime import datetime,timezone
 
 from sqlalchemy import Column, Integer, String
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     id = Column(Integer, primary_key=True)
@@ -27,6 +29,8 @@ class User(db.Model):
         cascade="all, delete-orphan"
     )
 
+    # login(), register() and share_list() look users up by name
+    __table_args__ = (db.Index('ix_user_username', 'username'),)
 
 
 class GroceryList(db.Model):
@@ -35,10 +39,24 @@ class GroceryList(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_by = db.Column(db.Integer, db.ForeignKey('user.id')) 
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Bumped once per committed item mutation; drives ETags and the change feed
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Set by delete_list(); the rows are purged in the background
+    deleted_at = db.Column(db.DateTime)
+    # Tombstones up to this version were purged; change feeds from before
+    # it can't report every deletion, so the client has to reload
+    tombstone_horizon = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     # Relationship to items (if not already added)
     items = db.relationship('GroceryItem', backref='grocery_list', cascade="all, delete-orphan", lazy=True)
    # To allow access to users this list is shared with
     shared_with = db.relationship('ListShare', backref='grocery_list', cascade="all, delete-orphan")
+    tombstones = db.relationship('ItemTombstone', cascade="all, delete-orphan", lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_grocery_list_user_id', 'user_id'),
+        db.Index('ix_grocery_list_created_by', 'created_by'),
+        db.Index('ix_grocery_list_deleted_at', 'deleted_at'),
+    )
 
 
 
@@ -46,20 +64,186 @@ class GroceryItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     quantity = db.Column(db.String(50))
+    # `quantity` parsed on write (see quantities.py); NULL when it didn't parse
+    quantity_value = db.Column(db.Float)
+    quantity_unit = db.Column(db.String(20))
     list_id = db.Column(db.Integer, db.ForeignKey('grocery_list.id'), nullable=False)
     completed = db.Column(db.Boolean, default=False)
+    # When it was checked off; completed items are archived some time after
+    completed_at = db.Column(db.DateTime)
     added_by = db.Column(db.String(100))
-    added_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    added_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # List version at which this item last changed
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     user = db.relationship('User')
-    
+
+    __table_args__ = (
+        db.Index('ix_grocery_item_list_version', 'list_id', 'version'),
+        # Matches the list page order and covers the dashboard's counts
+        db.Index('ix_grocery_item_list_order', 'list_id', 'completed', 'added_at', 'id'),
+        # Finds items due for the archive; NULL while an item is open
+        db.Index('ix_grocery_item_completed_at', 'completed_at'),
+        # SQLite otherwise hands a deleted item's id to the next one, and
+        # the audit log and change feed would mix the two up
+        {'sqlite_autoincrement': True},
+    )
+
+
+class ArchivedItem(db.Model):
+    # Completed items moved out of grocery_item (see archive.py), kept for
+    # purchase history only. Nothing on the list pages reads this table.
+    __tablename__ = 'archived_item'
+    id = db.Column(db.Integer, primary_key=True)
+    list_id = db.Column(db.Integer, db.ForeignKey('grocery_list.id'), nullable=False)
+    user_id = db.Column(db.Integer)
+    name = db.Column(db.String(100), nullable=False)
+    # quantities.item_key(name), for grouping purchases of the same thing
+    name_key = db.Column(db.String(100), nullable=False)
+    quantity = db.Column(db.String(50))
+    quantity_value = db.Column(db.Float)
+    quantity_unit = db.Column(db.String(20))
+    added_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_archived_item_list_name', 'list_id', 'name_key'),
+        db.Index('ix_archived_item_list_completed_at', 'list_id', 'completed_at'),
+    )
+
+
+class ItemEvent(db.Model):
+    # Append-only log of item changes, for undo and "who did this"; written
+    # in batches by audit.EventLog, never updated
+    __tablename__ = 'item_event'
+    id = db.Column(db.Integer, primary_key=True)
+    list_id = db.Column(db.Integer, db.ForeignKey('grocery_list.id'), nullable=False)
+    # List version the change was committed at
+    version = db.Column(db.Integer, nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    # None for changes nobody made directly (the archiver)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    op = db.Column(db.String(20), nullable=False)
+    at = db.Column(db.DateTime, nullable=False)
+    # JSON {"name", "quantity", "completed"} of the item before and after;
+    # before is NULL for adds, after for deletes
+    before = db.Column(db.Text)
+    after = db.Column(db.Text)
+    # On changes made by an undo: the oldest list version it reverted
+    undo_of = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_item_event_list_version', 'list_id', 'version'),
+        db.Index('ix_item_event_list_user_version', 'list_id', 'user_id', 'version'),
+    )
+
+
+class ListSnapshot(db.Model):
+    # A list's items at one version, so rebuilding an old state replays the
+    # events since the nearest snapshot rather than the whole log
+    __tablename__ = 'list_snapshot'
+    id = db.Column(db.Integer, primary_key=True)
+    list_id = db.Column(db.Integer, db.ForeignKey('grocery_list.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    # JSON [{"id", "name", "quantity", "completed"}, ...]
+    items = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (db.Index('ix_list_snapshot_list_version', 'list_id', 'version'),)
+
+
+class ItemTombstone(db.Model):
+    # Left behind by deleted items so the change feed can report removals;
+    # purged after purge.TOMBSTONE_TTL
+    __tablename__ = 'item_tombstone'
+    id = db.Column(db.Integer, primary_key=True)
+    list_id = db.Column(db.Integer, db.ForeignKey('grocery_list.id'), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.Index('ix_item_tombstone_list_version', 'list_id', 'version'),
+        db.Index('ix_item_tombstone_deleted_at', 'deleted_at'),
+    )
+
+class ShoppingSummary(db.Model):
+    # Open items per list, grouped by what to buy and its unit. Kept up to
+    # date by apply_item_ops so the shopping page doesn't group the items.
+    __tablename__ = 'shopping_summary'
+    id = db.Column(db.Integer, primary_key=True)
+    list_id = db.Column(db.Integer, db.ForeignKey('grocery_list.id'), nullable=False)
+    name_key = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    unit = db.Column(db.String(20), nullable=False, default='', server_default='')
+    open_items = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Sum of the parsed quantities, in the unit's base
+    total = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    # Open items whose quantity didn't parse
+    unmeasured = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.UniqueConstraint('list_id', 'name_key', 'unit', name='uq_shopping_summary_list_name_unit'),
+    )
+
+
 class ListShare(db.Model):
     __tablename__ = 'list_share'
     id = db.Column(db.Integer, primary_key=True)
     list_id = db.Column(db.Integer, db.ForeignKey('grocery_list.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     # Optional: enforce uniqueness so a user can’t be shared the same list multiple times
-    __table_args__ = (db.UniqueConstraint('list_id', 'user_id', name='_list_user_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('list_id', 'user_id', name='_list_user_uc'),
+        # The unique constraint serves lookups by list; this one serves "shared with me"
+        db.Index('ix_list_share_user_list', 'user_id', 'list_id'),
+    )
+
+
+class IdempotencyKey(db.Model):
+    # The response to a batch of item operations, by the key the client sent
+    # with it, so a retried request gets the same answer instead of being
+    # applied again. Rows expire after idempotency.IDEMPOTENCY_TTL.
+    __tablename__ = 'idempotency_key'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    list_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    # JSON [results, version]
+    response = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_key'),
+        db.Index('ix_idempotency_key_created_at', 'created_at'),
+    )
+
+
+class Job(db.Model):
+    # Work queued by requests and run by the job workers (see jobs.py)
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    # JSON keyword arguments for the job function
+    payload = db.Column(db.Text, nullable=False)
+    # queued, running, done or failed
+    status = db.Column(db.String(20), nullable=False, default='queued', server_default='queued')
+    # Who may see the job's status
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    max_attempts = db.Column(db.Integer, nullable=False, default=5, server_default='5')
+    # Earliest time the next attempt may start
+    run_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    locked_at = db.Column(db.DateTime)
+    # JSON progress while running, then the job function's return value
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
 
 
 class Item(db.Model):
@@ -0,0 +1,276 @@
+from datetime import datetime, timezone
+
+from blinker import Namespace
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from idempotency import remember, stored_response
+from models import db, User, GroceryList, GroceryItem, ItemTombstone, ArchivedItem
+from quantities import item_key
+from summary import SummaryDelta, parsed_quantity_values
+
+MAX_BATCH_OPS = 500
+ITEM_OPS = ('add', 'toggle', 'update', 'delete', 'archive')
+
+signals = Namespace()
+
+# Sent after a batch commits, with the list id as sender, the new list
+# `version` and the applied `events` in order. Also passes the `user_id`,
+# the time (`at`), `changes` with each item's state before and after for
+# the audit log, and `undo_of` (see apply_item_ops).
+items_changed = signals.signal('items-changed')
+
+
+def _error(message, **extra):
+    return {'ok': False, 'error': message, **extra}
+
+
+def item_state_query(list_id, item_ids):
+    return (
+        select(
+            GroceryItem.id, GroceryItem.version, GroceryItem.completed, GroceryItem.name,
+            GroceryItem.quantity, GroceryItem.quantity_value, GroceryItem.quantity_unit,
+        )
+        .where(GroceryItem.list_id == list_id, GroceryItem.id.in_(item_ids))
+    )
+
+
+def archived_rows_query(item_ids):
+    return select(
+        GroceryItem.id, GroceryItem.list_id, GroceryItem.user_id, GroceryItem.name, GroceryItem.quantity,
+        GroceryItem.quantity_value, GroceryItem.quantity_unit, GroceryItem.added_at, GroceryItem.completed_at,
+    ).where(GroceryItem.id.in_(item_ids))
+
+
+def _state(current, completed):
+    return {'name': current['name'], 'quantity': current['quantity'], 'completed': completed}
+
+
+def apply_item_ops(list_id, user_id, ops, idempotency_key=None, undo_of=None):
+    # Apply add/toggle/update/delete/archive operations to one list in a
+    # single transaction. Operations are replayed in order against the current
+    # state of the items they touch, then written with one statement per
+    # kind (bulk UPDATE/DELETE, one multi-row INSERT) and one commit.
+    # Any effective change bumps the list version once; touched items are
+    # stamped with it and deletes leave tombstones for the change feed.
+    # Archiving deletes a completed item after copying it to archived_item;
+    # everyone else sees a delete.
+    # The list's shopping summary rows are adjusted in the same transaction.
+    # An operation with a `version` only applies if the item is still at
+    # that version; otherwise its result is a conflict with the current item.
+    # With an idempotency key the response is stored with the changes, and a
+    # repeated key gets the stored response without applying anything.
+    # `undo_of` marks the batch as an undo in the audit log (see audit.undo).
+    # Returns one result dict per operation and the list's new version
+    # (None when nothing changed), then sends items_changed.
+    if idempotency_key is not None:
+        stored = stored_response(user_id, idempotency_key, list_id)
+        if stored is not None:
+            return stored
+
+    # Bumping the version first takes the list's write lock (SQLite's
+    # database lock, the row lock on Postgres) before any item is read, so
+    # concurrent batches on one list replay one after the other rather than
+    # from the same state. Rolled back if the batch changes nothing.
+    version = db.session.execute(
+        update(GroceryList)
+        .where(GroceryList.id == list_id)
+        .values(version=GroceryList.version + 1)
+        .returning(GroceryList.version),
+        execution_options={'synchronize_session': False},
+    ).scalar()
+    if version is None:
+        db.session.rollback()
+        return [_error('List not found') for _ in ops], None
+
+    ref_ids = {op.get('id') for op in ops if isinstance(op, dict) and op.get('op') != 'add'}
+    ref_ids = {i for i in ref_ids if isinstance(i, int)}
+    state, details, current = {}, {}, {}
+    if ref_ids:
+        for row in db.session.execute(item_state_query(list_id, ref_ids)):
+            state[row.id] = bool(row.completed)
+            details[row.id] = (row.name, row.quantity_value, row.quantity_unit)
+            current[row.id] = {'version': row.version, 'name': row.name, 'quantity': row.quantity}
+    # Deltas from the state read under the lock; from a stale read they
+    # would be added to the table twice and never come out again
+    summary = SummaryDelta(list_id)
+
+    results, events, changes = [], [], []
+    added, adds, added_changes = [], [], []
+    toggled, edited, deleted, archived = {}, {}, set(), set()
+    unchanged = []
+    now = datetime.now(timezone.utc)
+    for op in ops:
+        if not isinstance(op, dict) or op.get('op') not in ITEM_OPS:
+            results.append(_error('Unknown operation'))
+            continue
+
+        kind = op['op']
+        if kind in ('add', 'update'):
+            name, quantity = op.get('name'), op.get('quantity')
+            if not isinstance(name, str) or not name.strip():
+                results.append(_error('Missing name'))
+                continue
+            if quantity is not None and not isinstance(quantity, str):
+                quantity = str(quantity)
+
+        if kind in ('add', 'update'):
+            parsed = parsed_quantity_values(quantity)
+
+        if kind == 'add':
+            # Imports can add items that are already bought
+            completed = bool(op.get('completed'))
+            if not completed:
+                summary.add(name, parsed['quantity_value'], parsed['quantity_unit'])
+            adds.append({
+                'name': name,
+                'quantity': quantity,
+                **parsed,
+                'list_id': list_id,
+                'user_id': user_id,
+                'completed': completed,
+                'completed_at': now if completed else None,
+                'added_at': now,
+            })
+            added.append(len(results))
+            results.append({'ok': True, 'op': 'add'})
+            events.append({'op': 'add', 'item': adds[-1]})
+            added_changes.append({'op': 'add', 'id': None, 'before': None,
+                                  'after': {'name': name, 'quantity': quantity, 'completed': completed}})
+            changes.append(added_changes[-1])
+            continue
+
+        item_id = op.get('id')
+        if not isinstance(item_id, int) or item_id not in state or item_id in deleted:
+            results.append(_error('Item not found', op=kind, id=item_id))
+            continue
+        if 'version' in op and op['version'] != current[item_id]['version']:
+            # Changed since the client last saw it (by someone else, or by
+            # this client's own earlier requests)
+            results.append(_error('Conflict', op=kind, id=item_id,
+                                  item={**current[item_id], 'completed': state[item_id]}))
+            continue
+        before = _state(current[item_id], state[item_id])
+
+        if kind == 'toggle':
+            completed = op.get('completed')
+            completed = (not state[item_id]) if completed is None else bool(completed)
+            if completed == state[item_id]:
+                # Already so (a retried toggle, say): nothing to write; the
+                # version is filled in below in case the batch changes it
+                unchanged.append((len(results), item_id))
+                results.append({'ok': True, 'op': kind, 'id': item_id, 'completed': completed})
+                continue
+            summary.add(*details[item_id], sign=-1 if completed else 1)
+            state[item_id] = toggled[item_id] = completed
+            results.append({'ok': True, 'op': kind, 'id': item_id, 'completed': state[item_id]})
+            events.append({'op': kind, 'id': item_id, 'completed': state[item_id]})
+            changes.append({'op': kind, 'id': item_id, 'before': before, 'after': _state(current[item_id], completed)})
+        elif kind == 'update':
+            if not state[item_id]:
+                summary.add(*details[item_id], sign=-1)
+                summary.add(name, parsed['quantity_value'], parsed['quantity_unit'])
+            details[item_id] = (name, parsed['quantity_value'], parsed['quantity_unit'])
+            current[item_id].update(name=name, quantity=quantity)
+            edited[item_id] = {'name': name, 'quantity': quantity, **parsed}
+            results.append({'ok': True, 'op': kind, 'id': item_id})
+            events.append({'op': kind, 'id': item_id, 'name': name, 'quantity': quantity})
+            changes.append({'op': kind, 'id': item_id, 'before': before, 'after': _state(current[item_id], state[item_id])})
+        elif kind == 'archive':
+            if not state[item_id]:
+                results.append(_error('Not completed', op=kind, id=item_id))
+                continue
+            deleted.add(item_id)
+            archived.add(item_id)
+            results.append({'ok': True, 'op': kind, 'id': item_id})
+            events.append({'op': 'delete', 'id': item_id})
+            changes.append({'op': kind, 'id': item_id, 'before': before, 'after': None})
+        else:
+            if not state[item_id]:
+                summary.add(*details[item_id], sign=-1)
+            deleted.add(item_id)
+            results.append({'ok': True, 'op': kind, 'id': item_id})
+            events.append({'op': kind, 'id': item_id})
+            changes.append({'op': kind, 'id': item_id, 'before': before, 'after': None})
+
+    if not (toggled or edited or deleted or adds):
+        db.session.rollback()
+        for index, item_id in unchanged:
+            results[index]['version'] = current[item_id]['version']
+        return results, None
+
+    for index, item_id in unchanged:
+        results[index]['version'] = version if item_id in toggled or item_id in edited else current[item_id]['version']
+
+    for completed in (True, False):
+        ids = [i for i, value in toggled.items() if value is completed and i not in deleted]
+        if ids:
+            db.session.execute(
+                update(GroceryItem).where(GroceryItem.id.in_(ids))
+                .values(completed=completed, completed_at=now if completed else None, version=version),
+                execution_options={'synchronize_session': False},
+            )
+    edits = [{'id': i, 'version': version, **values} for i, values in edited.items() if i not in deleted]
+    if edits:
+        db.session.execute(update(GroceryItem), edits)
+    if archived:
+        rows = db.session.execute(archived_rows_query(archived)).all()
+        db.session.execute(insert(ArchivedItem), [{
+            'list_id': row.list_id,
+            'user_id': row.user_id,
+            'name': row.name,
+            'name_key': item_key(row.name),
+            'quantity': row.quantity,
+            'quantity_value': row.quantity_value,
+            'quantity_unit': row.quantity_unit,
+            'added_at': row.added_at,
+            # Checked off earlier in this batch
+            'completed_at': row.completed_at or now,
+        } for row in rows])
+    if deleted:
+        db.session.execute(
+            delete(GroceryItem).where(GroceryItem.id.in_(deleted)),
+            execution_options={'synchronize_session': False},
+        )
+        db.session.execute(insert(ItemTombstone), [
+            {'list_id': list_id, 'item_id': i, 'version': version, 'deleted_at': now} for i in deleted
+        ])
+    if adds:
+        for values in adds:
+            values['version'] = version
+        new_ids = db.session.scalars(insert(GroceryItem).returning(GroceryItem.id, sort_by_parameter_order=True), adds).all()
+        for index, values, change, new_id in zip(added, adds, added_changes, new_ids):
+            results[index]['id'] = values['id'] = change['id'] = new_id
+
+    summary.apply()
+
+    if idempotency_key is not None:
+        try:
+            remember(user_id, idempotency_key, list_id, results, version)
+        except IntegrityError:
+            # The same request was just applied by another worker
+            db.session.rollback()
+            return stored_response(user_id, idempotency_key, list_id)
+
+    if adds:
+        username = db.session.scalar(select(User.username).where(User.id == user_id))
+        events = [_add_event(event, username) if event['op'] == 'add' else event for event in events]
+
+    db.session.commit()
+    items_changed.send(list_id, version=version, events=events, user_id=user_id, at=now,
+                       changes=changes, undo_of=undo_of)
+    return results, version
+
+
+def _add_event(event, username):
+    # Same shape as queries.item_to_dict so clients render it the same way
+    item = event['item']
+    return {'op': 'add', 'item': {
+        'id': item['id'],
+        'version': item['version'],
+        'name': item['name'],
+        'quantity': item['quantity'],
+        'completed': item['completed'],
+        'added_at': item['added_at'].replace(tzinfo=None).isoformat(),
+        'added_by': username,
+    }}
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Werkzeug method strings: scrypt:N:r:p or pbkdf2:hash:iterations. Stored
+# hashes made with other parameters are replaced on the next sign-in.
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+# Processes hashing passwords, per web process; 0 hashes on the request
+# thread instead
+PASSWORD_HASH_WORKERS = min(2, os.cpu_count() or 1)
+# Hashes queued or running at once, per web process, before sign-ins get a
+# 503 instead of waiting
+PASSWORD_HASH_QUEUE = 16
+
+
+def hash_method(method):
+    # The full method string Werkzeug stores for `method`, defaults filled in
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        if not args:
+            args = ['32768', '8', '1']
+        if len(args) != 3 or not all(arg.isdigit() for arg in args):
+            raise ValueError(f'Expected scrypt:N:r:p, got {method}')
+    elif name == 'pbkdf2':
+        if not args:
+            args = ['sha256']
+        if len(args) == 1:
+            args.append(str(DEFAULT_PBKDF2_ITERATIONS))
+        if len(args) != 2 or not args[1].isdigit():
+            raise ValueError(f'Expected pbkdf2:hash:iterations, got {method}')
+    else:
+        raise ValueError(f'Unknown password hash method {method}')
+    return ':'.join([name, *args])
+
+
+def needs_rehash(pwhash, method):
+    return pwhash.partition('$')[0] != method
+
+
+# These run in the pool's processes
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _verify(pwhash, password, method):
+    # (matches, new hash or None); the rehash happens in the same round trip
+    if not check_password_hash(pwhash, password):
+        return False, None
+    return True, generate_password_hash(password, method) if needs_rehash(pwhash, method) else None
+
+
+class PasswordHasher:
+    # Runs the CPU-heavy hashing in a small process pool, so a burst of
+    # sign-ins doesn't tie up every request worker. The pool starts on the
+    # first sign-in.
+
+    def __init__(self, method=PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS, queue_size=PASSWORD_HASH_QUEUE):
+        self.method = hash_method(method)
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Spawned rather than forked: the pool starts from a web
+                # process that already has threads
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            raise ServiceUnavailable('Too many sign-ins at once; try again shortly', retry_after=1)
+        try:
+            pool = self._get_pool()
+            return pool.submit(function, *args).result()
+        except BrokenProcessPool:
+            # A pool process died; start a new pool for the next call
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        # (matches, new hash to store or None)
+        if not pwhash:
+            return False, None
+        return self._run(_verify, pwhash, password, self.method)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def get_password_hasher():
+    return current_app.extensions['passwords']
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', os.getenv('PASSWORD_HASH_METHOD', PASSWORD_HASH_METHOD))
+    app.config.setdefault('PASSWORD_HASH_WORKERS', int(os.getenv('PASSWORD_HASH_WORKERS', PASSWORD_HASH_WORKERS)))
+    app.extensions['passwords'] = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'],
+    )
@@ -0,0 +1,194 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from sqlalchemy import delete, select, update
+
+from archive import archive_age, archive_old_items
+from idempotency import purge_expired_keys
+from jobs import enqueue, job_kind
+from models import (
+    db, GroceryList, GroceryItem, ItemTombstone, ListShare, ShoppingSummary, ArchivedItem, ItemEvent, ListSnapshot,
+)
+from mutations import items_changed
+from queries import expired_tombstones_query
+
+PURGE_CHUNK_SIZE = 500
+# Seconds between purges once the background purger is running, for the
+# things that expire rather than being deleted by someone
+PURGE_INTERVAL = 3600
+# How long deletions stay in the change feed; a client that was away
+# longer reloads the list instead
+TOMBSTONE_TTL = timedelta(days=7)
+
+
+def soft_delete_list(grocery_list):
+    # Hide the list right away and queue a purge-list job, in one
+    # transaction, to remove the rows later. Returns the ids of every user
+    # who could see it.
+    db.session.execute(
+        update(GroceryList)
+        .where(GroceryList.id == grocery_list.id)
+        .values(deleted_at=datetime.now(timezone.utc)),
+        execution_options={'synchronize_session': False},
+    )
+    member_ids = set(db.session.scalars(select(ListShare.user_id).where(ListShare.list_id == grocery_list.id)))
+    # Read before committing: the commit expires the list, and the purger may
+    # have removed its row by the time it would be reloaded
+    member_ids |= {grocery_list.user_id, grocery_list.created_by} - {None}
+    enqueue('purge-list', {'list_id': grocery_list.id}, user_id=grocery_list.user_id)
+    return member_ids
+
+
+def _delete_in_chunks(model, list_id, chunk_size, on_chunk=None):
+    # Short transactions so other writers get the lock between chunks;
+    # on_chunk gets the number of rows each one removed
+    deleted = 0
+    while True:
+        chunk = select(model.id).where(model.list_id == list_id).limit(chunk_size).scalar_subquery()
+        result = db.session.execute(
+            delete(model).where(model.id.in_(chunk)),
+            execution_options={'synchronize_session': False},
+        )
+        db.session.commit()
+        deleted += result.rowcount
+        if on_chunk is not None:
+            on_chunk(result.rowcount)
+        if result.rowcount < chunk_size:
+            return deleted
+
+
+def purge_list(list_id, chunk_size=PURGE_CHUNK_SIZE, progress=None):
+    # `progress` is called with {'deleted': rows so far} after every chunk
+    # that removed something
+    deleted = 0
+
+    def chunk_done(count):
+        nonlocal deleted
+        deleted += count
+        if progress is not None and count:
+            progress({'deleted': deleted})
+
+    counts = {
+        'items': _delete_in_chunks(GroceryItem, list_id, chunk_size, chunk_done),
+        'tombstones': _delete_in_chunks(ItemTombstone, list_id, chunk_size, chunk_done),
+        'shares': _delete_in_chunks(ListShare, list_id, chunk_size, chunk_done),
+        'summary': _delete_in_chunks(ShoppingSummary, list_id, chunk_size, chunk_done),
+        'archived': _delete_in_chunks(ArchivedItem, list_id, chunk_size, chunk_done),
+        'events': _delete_in_chunks(ItemEvent, list_id, chunk_size, chunk_done),
+        'snapshots': _delete_in_chunks(ListSnapshot, list_id, chunk_size, chunk_done),
+    }
+    db.session.execute(
+        delete(GroceryList).where(GroceryList.id == list_id, GroceryList.deleted_at.is_not(None)),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+    return counts
+
+
+@job_kind('purge-list')
+def purge_list_job(job, list_id):
+    # Reporting progress keeps a long purge from looking stuck (JOB_TIMEOUT)
+    # and being started again by another worker
+    return purge_list(list_id, progress=job.progress)
+
+
+def purge_deleted_lists(chunk_size=PURGE_CHUNK_SIZE):
+    # Returns how many soft-deleted lists were removed
+    list_ids = db.session.scalars(select(GroceryList.id).where(GroceryList.deleted_at.is_not(None))).all()
+    for list_id in list_ids:
+        purge_list(list_id, chunk_size)
+    return len(list_ids)
+
+
+def purge_old_tombstones(age=TOMBSTONE_TTL, chunk_size=PURGE_CHUNK_SIZE):
+    # Removes tombstones older than `age`, moving each list's
+    # tombstone_horizon up to the newest version removed in the same
+    # transaction. Returns how many were removed.
+    cutoff = datetime.now(timezone.utc) - age
+    removed = 0
+    while True:
+        rows = db.session.execute(expired_tombstones_query(cutoff, chunk_size)).all()
+        horizons = {}
+        for row in rows:
+            horizons[row.list_id] = max(horizons.get(row.list_id, 0), row.version)
+        for list_id, version in horizons.items():
+            db.session.execute(
+                update(GroceryList)
+                .where(GroceryList.id == list_id, GroceryList.tombstone_horizon < version)
+                .values(tombstone_horizon=version),
+                execution_options={'synchronize_session': False},
+            )
+        if rows:
+            db.session.execute(
+                delete(ItemTombstone).where(ItemTombstone.id.in_([row.id for row in rows])),
+                execution_options={'synchronize_session': False},
+            )
+        db.session.commit()
+        removed += len(rows)
+        if len(rows) < chunk_size:
+            return removed
+
+
+class Purger:
+    # Background thread that removes expired idempotency keys and
+    # tombstones and any deleted lists whose purge-list job gave up, and
+    # archives old completed items, every PURGE_INTERVAL. On platforms that
+    # freeze the process between requests run `flask purge-deleted-lists`,
+    # `flask purge-idempotency-keys`, `flask purge-tombstones` and
+    # `flask archive-completed` on a schedule instead.
+
+    def __init__(self, app):
+        self.app = app
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='list-purger', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(PURGE_INTERVAL)
+            with self.app.app_context():
+                try:
+                    purge_deleted_lists()
+                    purge_expired_keys()
+                    purge_old_tombstones()
+                    age = archive_age(self.app)
+                    if age is not None:
+                        archive_old_items(age)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Background purge failed')
+
+
+@click.command('purge-deleted-lists')
+@click.option('--chunk-size', default=PURGE_CHUNK_SIZE, type=int)
+def purge_deleted_lists_command(chunk_size):
+    """Remove soft-deleted lists with their items and shares."""
+    click.echo(f'Purged {purge_deleted_lists(chunk_size)} lists.')
+
+
+@click.command('purge-tombstones')
+def purge_tombstones_command():
+    """Remove tombstones of items deleted longer ago than the change feed keeps them."""
+    click.echo(f'Removed {purge_old_tombstones()} tombstones.')
+
+
+def _start_tombstone_purge(list_id, version, events, **extra):
+    # Deletions leave tombstones for the purger to expire
+    purger = current_app.extensions.get('purger')
+    if purger is not None and any(event['op'] == 'delete' for event in events):
+        purger.start()
+
+
+def init_app(app):
+    app.extensions['purger'] = Purger(app)
+    items_changed.connect(_start_tombstone_purge)
+    app.cli.add_command(purge_deleted_lists_command)
+    app.cli.add_command(purge_tombstones_command)
@@ -0,0 +1,100 @@
+import re
+from collections import namedtuple
+
+# value is in the unit's base (grams, millilitres, pieces); both are None
+# when the text isn't a quantity we understand
+Quantity = namedtuple('Quantity', 'value unit')
+UNPARSED = Quantity(None, None)
+
+# Spelling -> (base unit, factor). Count-like units share the '' base.
+UNITS = {}
+for spellings, base, factor in (
+    (('mg', 'milligram', 'milligrams'), 'g', 0.001),
+    (('g', 'gr', 'gram', 'grams', 'gramme', 'grammes'), 'g', 1),
+    (('kg', 'kgs', 'kilo', 'kilos', 'kilogram', 'kilograms'), 'g', 1000),
+    (('oz', 'ounce', 'ounces'), 'g', 28.349523125),
+    (('lb', 'lbs', 'pound', 'pounds'), 'g', 453.59237),
+    (('ml', 'millilitre', 'millilitres', 'milliliter', 'milliliters'), 'ml', 1),
+    (('cl', 'centilitre', 'centilitres', 'centiliter', 'centiliters'), 'ml', 10),
+    (('dl', 'decilitre', 'decilitres', 'deciliter', 'deciliters'), 'ml', 100),
+    (('l', 'ltr', 'litre', 'litres', 'liter', 'liters'), 'ml', 1000),
+    (('x', 'pc', 'pcs', 'piece', 'pieces', 'ea', 'each'), '', 1),
+    (('dozen', 'doz'), '', 12),
+):
+    for spelling in spellings:
+        UNITS[spelling] = (base, factor)
+
+FRACTIONS = {'½': 0.5, '⅓': 1 / 3, '⅔': 2 / 3, '¼': 0.25, '¾': 0.75}
+
+NUMBER = r'(?:\d+(?:[.,]\d+)?(?:\s+\d+/\d+)?|\d+/\d+|[½⅓⅔¼¾]|\d+\s*[½⅓⅔¼¾])'
+QUANTITY = re.compile(
+    rf'^(?:(?P<article>an?)\s+|(?P<number>{NUMBER})\s*(?:x\s*)?)?'
+    r'(?P<unit>[^\W\d_]+)?\.?$'
+)
+
+
+def _number(text):
+    text = text.replace(',', '.')
+    total = 0.0
+    for part in text.split():
+        for symbol, value in FRACTIONS.items():
+            if part.endswith(symbol):
+                total += value
+                part = part[:-1]
+        if '/' in part:
+            numerator, denominator = part.split('/')
+            if float(denominator) == 0:
+                raise ValueError(text)
+            total += float(numerator) / float(denominator)
+        elif part:
+            total += float(part)
+    return total
+
+
+def _singular(word):
+    # "packs" and "pack" should add up; good enough for unit words
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def parse_quantity(text):
+    # "2 kg" -> (2000, 'g'), "500g" -> (500, 'g'), "3" -> (3, ''),
+    # "2 packs" -> (2, 'pack'), "a dozen" -> (12, ''); anything else -> UNPARSED
+    if not text:
+        return UNPARSED
+    match = QUANTITY.match(' '.join(text.lower().split()))
+    if match is None or not (match['number'] or match['unit']):
+        return UNPARSED
+    try:
+        value = _number(match['number']) if match['number'] else 1.0
+    except ValueError:
+        return UNPARSED
+    if match['article'] is None and match['number'] is None and match['unit'] not in UNITS:
+        return UNPARSED  # a bare word like "some"
+
+    unit = match['unit'] or ''
+    if unit in UNITS:
+        base, factor = UNITS[unit]
+        return Quantity(value * factor, base)
+    return Quantity(value, _singular(unit))
+
+
+def item_key(name):
+    # Items with the same key are the same thing to buy
+    return ' '.join(name.lower().split())
+
+
+def _number_text(value):
+    value = round(value, 2)
+    return str(int(value)) if value == int(value) else f'{value:g}'
+
+
+def format_quantity(value, unit):
+    if unit == 'g' and value >= 1000:
+        return f'{_number_text(value / 1000)} kg'
+    if unit == 'ml' and value >= 1000:
+        return f'{_number_text(value / 1000)} l'
+    if not unit:
+        return _number_text(value)
+    return f'{_number_text(value)} {unit}'
@@ -0,0 +1,313 @@
+from datetime import datetime
+
+from sqlalchemy import case, func, or_, select, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, User, GroceryList, GroceryItem, ItemTombstone, ListShare, ShoppingSummary, ArchivedItem
+
+DASHBOARD_PAGE_SIZE = 24
+ITEMS_PAGE_SIZE = 100
+
+
+def accessible_list_ids(user_id):
+    # Lists shared with the user, as a subquery usable inside IN (...)
+    return select(ListShare.list_id).where(ListShare.user_id == user_id)
+
+
+def dashboard_lists_query(user_id, after=None, limit=DASHBOARD_PAGE_SIZE):
+    completed = func.coalesce(func.sum(case((GroceryItem.completed, 1), else_=0)), 0)
+    query = (
+        select(
+            GroceryList.id,
+            GroceryList.name,
+            GroceryList.user_id,
+            GroceryList.created_by,
+            GroceryList.created_at,
+            GroceryList.version,
+            func.count(GroceryItem.id).label('item_count'),
+            completed.label('completed_count'),
+        )
+        .outerjoin(GroceryItem, GroceryItem.list_id == GroceryList.id)
+        .where(
+            or_(
+                GroceryList.user_id == user_id,
+                GroceryList.id.in_(accessible_list_ids(user_id)),
+            ),
+            GroceryList.deleted_at.is_(None),
+        )
+        .group_by(GroceryList.id)
+        .order_by(GroceryList.id.desc())
+        .limit(limit + 1)
+    )
+    if after is not None:
+        query = query.where(GroceryList.id < after)
+    return query
+
+
+def dashboard_lists(user_id, after=None, limit=DASHBOARD_PAGE_SIZE):
+    # Owned and shared lists in one query, with item counts aggregated in SQL
+    # instead of loading every item just to call |length on it.
+    # Pages are keyed on the list id (newest first); `after` is the last id
+    # of the previous page.
+    rows = db.session.execute(dashboard_lists_query(user_id, after, limit)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return rows, next_cursor
+
+
+def encode_item_cursor(item):
+    return item_cursor(item.completed, item.added_at, item.id)
+
+
+def item_cursor(completed, added_at, item_id):
+    return f"{int(bool(completed))}~{added_at.isoformat()}~{item_id}"
+
+
+def decode_item_cursor(cursor):
+    # Returns None for anything that isn't a cursor we handed out
+    try:
+        completed, added_at, item_id = cursor.split('~')
+        return bool(int(completed)), datetime.fromisoformat(added_at), int(item_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def list_items_query(list_id, after=None, limit=ITEMS_PAGE_SIZE):
+    order = (GroceryItem.completed, GroceryItem.added_at, GroceryItem.id)
+    query = (
+        select(GroceryItem)
+        .options(joinedload(GroceryItem.user))
+        .where(GroceryItem.list_id == list_id)
+        .order_by(*order)
+        .limit(limit + 1)
+    )
+    if after is not None:
+        query = query.where(tuple_(*order) > tuple_(*after))
+    return query
+
+
+def list_items_page(list_id, after=None, limit=ITEMS_PAGE_SIZE):
+    # Open items first, then by age. The author is joined into the same
+    # query so rendering item.user.username doesn't lazy-load per row.
+    # `after` is a decoded cursor: (completed, added_at, id).
+    items = db.session.scalars(list_items_query(list_id, after, limit)).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_item_cursor(items[-1])
+    return items, next_cursor
+
+
+def changed_items_query(list_id, since):
+    return (
+        select(GroceryItem)
+        .options(joinedload(GroceryItem.user))
+        .where(GroceryItem.list_id == list_id, GroceryItem.version > since)
+        .order_by(GroceryItem.version, GroceryItem.id)
+    )
+
+
+def deleted_items_query(list_id, since):
+    return (
+        select(ItemTombstone.item_id)
+        .where(ItemTombstone.list_id == list_id, ItemTombstone.version > since)
+    )
+
+
+def expired_tombstones_query(cutoff, limit):
+    # Tombstones of deletions before `cutoff`, oldest first
+    return (
+        select(ItemTombstone.id, ItemTombstone.list_id, ItemTombstone.version)
+        .where(ItemTombstone.deleted_at < cutoff)
+        .order_by(ItemTombstone.deleted_at)
+        .limit(limit)
+    )
+
+
+def list_changes(list_id, since):
+    # Items touched after version `since`, plus ids of items deleted since
+    items = db.session.scalars(changed_items_query(list_id, since)).all()
+    deleted = db.session.scalars(deleted_items_query(list_id, since)).all()
+    return items, deleted
+
+
+def item_to_dict(item):
+    return {
+        'id': item.id,
+        'version': item.version,
+        'name': item.name,
+        'quantity': item.quantity,
+        'completed': bool(item.completed),
+        'added_at': item.added_at.isoformat() if item.added_at else None,
+        'added_by': item.user.username if item.user else None,
+    }
+
+
+def shopping_summary_query(list_ids):
+    # Open items in `list_ids` added up per name and unit; the summary rows
+    # are already per list, so this groups a few rows per name
+    return (
+        select(
+            ShoppingSummary.name_key,
+            ShoppingSummary.unit,
+            func.max(ShoppingSummary.name).label('name'),
+            func.sum(ShoppingSummary.open_items).label('open_items'),
+            func.sum(ShoppingSummary.total).label('total'),
+            func.sum(ShoppingSummary.unmeasured).label('unmeasured'),
+        )
+        .where(ShoppingSummary.list_id.in_(list_ids), ShoppingSummary.open_items > 0)
+        .group_by(ShoppingSummary.name_key, ShoppingSummary.unit)
+        .order_by(ShoppingSummary.name_key, ShoppingSummary.unit)
+    )
+
+
+def export_items_query(list_ids):
+    # Every item in `list_ids` with its list name, in a stable order for
+    # streaming out with yield_per
+    return (
+        select(
+            GroceryList.name.label('list_name'),
+            GroceryItem.name,
+            GroceryItem.quantity,
+            GroceryItem.completed,
+            GroceryItem.added_at,
+            User.username.label('added_by'),
+        )
+        .join(GroceryList, GroceryList.id == GroceryItem.list_id)
+        .outerjoin(User, User.id == GroceryItem.user_id)
+        .where(GroceryItem.list_id.in_(list_ids))
+        .order_by(GroceryItem.list_id, GroceryItem.id)
+    )
+
+
+def archive_due_query(cutoff, limit):
+    # Completed items checked off before `cutoff`, oldest first
+    return (
+        select(GroceryItem.list_id, GroceryItem.id)
+        .where(GroceryItem.completed_at < cutoff, GroceryItem.completed.is_(True))
+        .order_by(GroceryItem.completed_at)
+        .limit(limit)
+    )
+
+
+def purchase_history_query(list_ids, since=None):
+    # Archived purchases in `list_ids` per name and unit
+    query = (
+        select(
+            ArchivedItem.name_key,
+            ArchivedItem.quantity_unit,
+            func.max(ArchivedItem.name).label('name'),
+            func.count().label('purchases'),
+            func.count(ArchivedItem.quantity_value).label('measured'),
+            func.sum(ArchivedItem.quantity_value).label('total'),
+            func.min(ArchivedItem.completed_at).label('first_bought'),
+            func.max(ArchivedItem.completed_at).label('last_bought'),
+        )
+        .where(ArchivedItem.list_id.in_(list_ids))
+        .group_by(ArchivedItem.name_key, ArchivedItem.quantity_unit)
+    )
+    if since is not None:
+        query = query.where(ArchivedItem.completed_at >= since)
+    return query
+
+
+# JSON API: each resource's fields as column expressions, so a `fields=`
+# request selects only those columns (and joins only what they need)
+
+def _item_count(completed=None):
+    count = select(func.count(GroceryItem.id)).where(GroceryItem.list_id == GroceryList.id)
+    if completed is not None:
+        count = count.where(GroceryItem.completed == completed)
+    return count.scalar_subquery()
+
+
+LIST_FIELDS = {
+    'id': lambda: GroceryList.id,
+    'name': lambda: GroceryList.name,
+    'user_id': lambda: GroceryList.user_id,
+    'created_by': lambda: GroceryList.created_by,
+    'created_at': lambda: GroceryList.created_at,
+    'version': lambda: GroceryList.version,
+    'item_count': _item_count,
+    'completed_count': lambda: _item_count(completed=True),
+}
+
+ITEM_FIELDS = {
+    'id': lambda: GroceryItem.id,
+    'list_id': lambda: GroceryItem.list_id,
+    'version': lambda: GroceryItem.version,
+    'name': lambda: GroceryItem.name,
+    'quantity': lambda: GroceryItem.quantity,
+    'quantity_value': lambda: GroceryItem.quantity_value,
+    'quantity_unit': lambda: GroceryItem.quantity_unit,
+    'completed': lambda: GroceryItem.completed,
+    'added_at': lambda: GroceryItem.added_at,
+    'added_by': lambda: User.username,
+}
+
+SHARE_FIELDS = {
+    'id': lambda: ListShare.id,
+    'list_id': lambda: ListShare.list_id,
+    'user_id': lambda: ListShare.user_id,
+    'username': lambda: User.username,
+}
+
+
+def _columns(available, fields):
+    return [available[name]().label(name) for name in fields]
+
+
+def api_lists_query(user_id, fields, after=None, limit=DASHBOARD_PAGE_SIZE, list_id=None):
+    # Live lists the user owns or was shared, newest first. The id is also
+    # selected as `cursor_id` for the next page's cursor.
+    query = (
+        select(*_columns(LIST_FIELDS, fields), GroceryList.id.label('cursor_id'))
+        .where(
+            or_(
+                GroceryList.user_id == user_id,
+                GroceryList.id.in_(accessible_list_ids(user_id)),
+            ),
+            GroceryList.deleted_at.is_(None),
+        )
+        .order_by(GroceryList.id.desc())
+        .limit(limit + 1)
+    )
+    if list_id is not None:
+        query = query.where(GroceryList.id == list_id)
+    if after is not None:
+        query = query.where(GroceryList.id < after)
+    return query
+
+
+def api_items_query(list_id, fields, after=None, limit=ITEMS_PAGE_SIZE):
+    # Same order and cursor as list_items_query
+    order = (GroceryItem.completed, GroceryItem.added_at, GroceryItem.id)
+    query = (
+        select(*_columns(ITEM_FIELDS, fields), *(column.label(f'cursor_{column.key}') for column in order))
+        .select_from(GroceryItem)
+        .where(GroceryItem.list_id == list_id)
+        .order_by(*order)
+        .limit(limit + 1)
+    )
+    if 'added_by' in fields:
+        query = query.outerjoin(User, User.id == GroceryItem.user_id)
+    if after is not None:
+        query = query.where(tuple_(*order) > tuple_(*after))
+    return query
+
+
+def api_shares_query(list_id, fields, after=None, limit=ITEMS_PAGE_SIZE):
+    query = (
+        select(*_columns(SHARE_FIELDS, fields), ListShare.id.label('cursor_id'))
+        .select_from(ListShare)
+        .where(ListShare.list_id == list_id)
+        .order_by(ListShare.id)
+        .limit(limit + 1)
+    )
+    if 'username' in fields:
+        query = query.join(User, User.id == ListShare.user_id)
+    if after is not None:
+        query = query.where(ListShare.id > after)
+    return query
@@ -0,0 +1,125 @@
+import re
+from datetime import datetime
+
+import click
+from sqlalchemy import select
+
+from models import db, User, GroceryList, GroceryItem, IdempotencyKey, ListShare, ArchivedItem
+from access import access_query
+from idempotency import stored_key_query
+from audit import events_between_query, list_events_query, snapshot_due_query, snapshot_query, user_events_query
+from jobs import claim_job_query, due_job_query, stale_jobs_query
+from mutations import item_state_query
+from search import item_search_query, vocabulary_query
+from queries import (
+    ITEM_FIELDS,
+    LIST_FIELDS,
+    SHARE_FIELDS,
+    api_items_query,
+    api_lists_query,
+    api_shares_query,
+    archive_due_query,
+    changed_items_query,
+    dashboard_lists_query,
+    deleted_items_query,
+    expired_tombstones_query,
+    export_items_query,
+    list_items_query,
+    purchase_history_query,
+    shopping_summary_query,
+)
+
+# A virtual table (FTS5) "scan" is a lookup in its own index
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)(?!\S+ VIRTUAL TABLE INDEX)')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on ')
+
+
+def route_queries(user_id=1, list_id=1):
+    # The statements each route issues, built by the same functions the
+    # routes use. Add new hot queries here so they get plan-checked too.
+    cursor = (False, datetime(2025, 1, 1), 1)
+    return [
+        ('list access', access_query(user_id)),
+        ('dashboard', dashboard_lists_query(user_id)),
+        ('dashboard (next page)', dashboard_lists_query(user_id, after=100)),
+        ('view_list', list_items_query(list_id)),
+        ('list_items (next page)', list_items_query(list_id, after=cursor)),
+        ('list_changes (items)', changed_items_query(list_id, 5)),
+        ('list_changes (deleted)', deleted_items_query(list_id, 5)),
+        ('item mutations', item_state_query(list_id, [1, 2, 3])),
+        ('item mutations (idempotency key)', stored_key_query(user_id, 'f1c2')),
+        ('login / register', select(User).where(User.username == 'alice')),
+        ('sessionLogin', select(User).where(User.email == 'alice@example.com')),
+        ('share_list (existing share)', select(ListShare).where(ListShare.list_id == list_id, ListShare.user_id == user_id)),
+        ('share_list (members)', select(ListShare).where(ListShare.list_id == list_id)),
+        ('share_list (member users)', select(User).where(User.id.in_([1, 2]))),
+        ('api lists', api_lists_query(user_id, list(LIST_FIELDS))),
+        ('api items (next page)', api_items_query(list_id, list(ITEM_FIELDS), after=cursor)),
+        ('api shares', api_shares_query(list_id, list(SHARE_FIELDS))),
+        ('shopping', shopping_summary_query([1, 2, 3])),
+        ('export', export_items_query([1, 2, 3])),
+        ('clear completed', select(GroceryItem.id).where(GroceryItem.list_id == list_id, GroceryItem.completed.is_(True))),
+        ('archiver', archive_due_query(datetime(2025, 1, 1), 500)),
+        ('purchase history', purchase_history_query([1, 2, 3], since=datetime(2025, 1, 1))),
+        ('item search', item_search_query(db.engine.dialect.name, [1, 2, 3], ['mil', 'oat'])),
+        ('item search (vocabulary)', vocabulary_query([1, 2, 3])),
+        ('item search (archived vocabulary)', vocabulary_query([1, 2, 3], model=ArchivedItem)),
+        ('purge (deleted lists)', select(GroceryList.id).where(GroceryList.deleted_at.is_not(None))),
+        ('purge (item chunk)', select(GroceryItem.id).where(GroceryItem.list_id == list_id).limit(500)),
+        ('purge (expired keys)', select(IdempotencyKey.id).where(IdempotencyKey.created_at < datetime(2025, 1, 1)).limit(1000)),
+        ('purge (expired tombstones)', expired_tombstones_query(datetime(2025, 1, 1), 500)),
+        ('job runner (poll)', due_job_query(datetime(2025, 1, 1))),
+        ('job runner (claim)', claim_job_query(datetime(2025, 1, 1))),
+        ('job runner (stale jobs)', stale_jobs_query(datetime(2025, 1, 1))),
+        ('audit log', list_events_query(list_id, after=(5, 10))),
+        ('audit log (one item)', list_events_query(list_id, item_id=1)),
+        ('audit log (snapshots due)', snapshot_due_query([1, 2, 3])),
+        ('undo', user_events_query(list_id, user_id, after=(5, 10))),
+        ('list version (snapshot)', snapshot_query(list_id, 5)),
+        ('list version (events)', events_between_query(list_id, 5, 10)),
+    ]
+
+
+def explain(connection, statement):
+    # Plan lines for `statement` on this connection's database
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)
+        return [row[-1] for row in rows]
+
+    # Empty or tiny tables make sequential scans look cheapest; forbid them
+    # so the plan shows whether a usable index exists at all
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    return [row[0] for row in connection.exec_driver_sql(f'EXPLAIN {compiled}', params)]
+
+
+def full_scans(connection, plan):
+    pattern = SQLITE_FULL_SCAN if connection.dialect.name == 'sqlite' else POSTGRES_FULL_SCAN
+    return [line for line in plan if pattern.search(line.strip())]
+
+
+@click.command('check-query-plans')
+@click.option('-v', '--verbose', is_flag=True, help='Print every plan, not just failures.')
+def check_query_plans_command(verbose):
+    """Fail if any route query needs a full table scan."""
+    failures = 0
+    with db.engine.connect() as connection, connection.begin() as transaction:
+        for name, statement in route_queries():
+            plan = explain(connection, statement)
+            scans = full_scans(connection, plan)
+            failures += bool(scans)
+            click.echo(f"{'FULL SCAN' if scans else 'ok':>9}  {name}")
+            if scans or verbose:
+                for line in plan:
+                    click.echo(f'           {line}')
+        transaction.rollback()
+    if failures:
+        raise click.ClickException(f'{failures} route queries scan whole tables')
+
+
+def init_app(app):
+    app.cli.add_command(check_query_plans_command)
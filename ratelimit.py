@@ -0,0 +1,68 @@
+import math
+import os
+import threading
+import time
+
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+from cache import TTLCache
+
+# (attempts, per seconds) before sign-in attempts are turned away, checked
+# before any password is hashed. Buckets are per process, so with several
+# workers the effective limit is that many times higher.
+LOGIN_USERNAME_LIMIT = (10, 60)
+LOGIN_IP_LIMIT = (30, 60)
+RATE_LIMIT_KEYS = 100000
+
+
+class TokenBucket:
+    # Per-key token buckets holding up to `burst` tokens, refilled at `rate`
+    # tokens per second. Safe to share between threads.
+
+    def __init__(self, burst, rate, maxsize=RATE_LIMIT_KEYS, clock=time.monotonic):
+        self.burst = burst
+        self.rate = rate
+        self.clock = clock
+        # A bucket left alone until it is full again is the same as a new
+        # one, so it can expire then
+        self._buckets = TTLCache(maxsize=maxsize, ttl=burst / rate, clock=clock)
+        self._lock = threading.Lock()
+
+    def take(self, key, tokens=1):
+        # 0 when the tokens were taken, otherwise seconds until they would be
+        with self._lock:
+            now = self.clock()
+            available, updated = self._buckets.get(key, (self.burst, now))
+            available = min(self.burst, available + (now - updated) * self.rate)
+            if available < tokens:
+                return (tokens - available) / self.rate
+            self._buckets.set(key, (available - tokens, now))
+            return 0
+
+
+def _bucket(limit):
+    attempts, seconds = limit
+    return TokenBucket(attempts, attempts / seconds)
+
+
+def limit_login(username=None):
+    # Raises 429 when this client, or anyone trying this username, is over
+    # the limit. `request.remote_addr` is the proxy's address unless the
+    # app is wrapped in ProxyFix.
+    if not current_app.config['RATE_LIMITS_ENABLED']:
+        return
+    buckets = current_app.extensions['rate_limits']
+    wait = buckets['login_ip'].take(request.remote_addr)
+    if not wait and username:
+        wait = buckets['login_username'].take(username.strip().lower())
+    if wait:
+        raise TooManyRequests('Too many sign-in attempts; try again shortly', retry_after=math.ceil(wait))
+
+
+def init_app(app):
+    app.config.setdefault('RATE_LIMITS_ENABLED', os.getenv('RATE_LIMITS', '1').lower() in ('1', 'true', 'yes', 'on'))
+    app.extensions['rate_limits'] = {
+        'login_username': _bucket(LOGIN_USERNAME_LIMIT),
+        'login_ip': _bucket(LOGIN_IP_LIMIT),
+    }
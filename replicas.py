@@ -0,0 +1,93 @@
+import os
+import random
+import time
+
+import click
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND_PREFIX = 'replica_'
+# After a user writes, their reads stay on the primary this many seconds,
+# so they see their own changes while the replicas catch up
+REPLICA_PIN_SECONDS = 10
+PIN_KEY = 'primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def replica_urls():
+    # DATABASE_REPLICA_URLS: comma-separated read replicas of DATABASE_URL
+    return [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+
+
+def replica_binds(urls):
+    return {f'{REPLICA_BIND_PREFIX}{n}': url for n, url in enumerate(urls)}
+
+
+def replica_engines(db):
+    return [engine for key, engine in db.engines.items() if key and key.startswith(REPLICA_BIND_PREFIX)]
+
+
+class RoutingSession(Session):
+    # Reads during GET and HEAD requests go to the replica picked for the
+    # request. Writes, and every statement after the first write, go to the
+    # primary, as does everything outside a request (CLI, jobs).
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info['wrote'] = True
+            elif not self.info.get('wrote') and has_request_context() and g.get('db_replica') is not None:
+                return g.db_replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@click.command('copy-to-replicas')
+def copy_to_replicas_command():
+    """Copy the primary SQLite database over each replica file."""
+    # Stands in for replication when trying a second SQLite file as the
+    # replica locally; real replicas are kept up to date by the database
+    db = current_app.extensions['sqlalchemy']
+    engines = replica_engines(db)
+    if not engines:
+        raise click.ClickException('Set DATABASE_REPLICA_URLS first')
+    if any(engine.dialect.name != 'sqlite' for engine in [db.engine, *engines]):
+        raise click.ClickException('Only SQLite databases can be copied')
+    source = db.engine.raw_connection()
+    try:
+        for engine in engines:
+            target = engine.raw_connection()
+            try:
+                source.driver_connection.backup(target.driver_connection)
+            finally:
+                target.close()
+            click.echo(f'Copied to {engine.url.database}')
+    finally:
+        source.close()
+
+
+def init_app(app):
+    db = app.extensions['sqlalchemy']
+    app.config.setdefault('REPLICA_PIN_SECONDS', int(os.getenv('REPLICA_PIN_SECONDS', REPLICA_PIN_SECONDS)))
+    app.cli.add_command(copy_to_replicas_command)
+    with app.app_context():
+        engines = replica_engines(db)
+    if not engines:
+        return
+
+    def pin_to_primary():
+        session[PIN_KEY] = time.time() + app.config['REPLICA_PIN_SECONDS']
+
+    @app.before_request
+    def _route_reads():
+        if request.method not in READ_METHODS:
+            pin_to_primary()
+        elif session.get(PIN_KEY, 0) < time.time():
+            g.db_replica = random.choice(engines)
+
+    @app.after_request
+    def _pin_after_write(response):
+        # A GET that wrote anyway (delete_list, say)
+        if g.get('db_replica') is not None and db.session.registry.has() and db.session.info.get('wrote'):
+            pin_to_primary()
+        return response
@@ -0,0 +1,266 @@
+import heapq
+import re
+import threading
+import weakref
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import DDL, column, event, func, select, table
+
+from access import get_access
+from cache import TTLCache
+from models import db, GroceryItem, ArchivedItem
+from mutations import items_changed
+
+SUGGESTION_LIMIT = 10
+# Grouped names fetched from the index before ranking in Python
+SEARCH_CANDIDATES = 50
+VOCABULARY_CACHE_SIZE = 500
+VOCABULARY_TTL = 600
+# Most-used names kept per vocabulary
+VOCABULARY_MAX_NAMES = 20000
+# Days after which a name's uses count half as much as fresh ones
+RECENCY_DAYS = 30
+
+# SQLite: an external-content FTS5 table over grocery_item.name, kept in sync
+# by triggers. Batch migrations that recreate grocery_item drop the triggers;
+# re-run these statements afterwards.
+SQLITE_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS grocery_item_fts USING fts5("
+    "name, content='grocery_item', content_rowid='id', prefix='2 3', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS grocery_item_fts_insert AFTER INSERT ON grocery_item BEGIN "
+    "INSERT INTO grocery_item_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS grocery_item_fts_delete AFTER DELETE ON grocery_item BEGIN "
+    "INSERT INTO grocery_item_fts(grocery_item_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS grocery_item_fts_update AFTER UPDATE OF name ON grocery_item BEGIN "
+    "INSERT INTO grocery_item_fts(grocery_item_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO grocery_item_fts(rowid, name) VALUES (new.id, new.name); END",
+)
+# Postgres: a trigram index serves ILIKE '%term%'
+POSTGRES_SEARCH_DDL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_grocery_item_name_trgm ON grocery_item USING gin (name gin_trgm_ops)',
+)
+
+grocery_item_fts = table('grocery_item_fts', column('rowid'), column('name'))
+
+WORD = re.compile(r'\w+')
+
+
+def search_terms(text):
+    return WORD.findall(text.lower())
+
+
+def _naive_utc(value):
+    if value is None:
+        return datetime.min
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def utcnow():
+    # Naive UTC, like the added_at values SQLite and Postgres hand back
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def rank(uses, last_used, now):
+    # Frequency, discounted by how long ago the name was last added
+    age_days = max((now - _naive_utc(last_used)).total_seconds() / 86400, 0)
+    return uses / (1 + age_days / RECENCY_DAYS)
+
+
+def suggestion(name, uses, last_used):
+    last_used = _naive_utc(last_used)
+    return {'name': name, 'uses': uses, 'last_used': last_used.isoformat() if last_used != datetime.min else None}
+
+
+def item_search_query(dialect_name, list_ids, terms, limit=SEARCH_CANDIDATES):
+    # Distinct names (case-insensitively) in `list_ids` matching every term,
+    # most used first. SQLite matches word prefixes, Postgres substrings.
+    query = (
+        select(
+            func.max(GroceryItem.name).label('name'),
+            func.count().label('uses'),
+            func.max(GroceryItem.added_at).label('last_used'),
+        )
+        .where(GroceryItem.list_id.in_(list_ids))
+        .group_by(func.lower(GroceryItem.name))
+        .order_by(func.count().desc(), func.max(GroceryItem.added_at).desc())
+        .limit(limit)
+    )
+    if dialect_name == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return (
+            query.select_from(grocery_item_fts)
+            .join(GroceryItem, GroceryItem.id == grocery_item_fts.c.rowid)
+            .where(grocery_item_fts.c.name.match(match))
+        )
+    for term in terms:
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.where(GroceryItem.name.ilike(f'%{escaped}%', escape='\\'))
+    return query
+
+
+def vocabulary_query(list_ids, limit=VOCABULARY_MAX_NAMES, model=GroceryItem):
+    return (
+        select(
+            func.max(model.name).label('name'),
+            func.count().label('uses'),
+            func.max(model.added_at).label('last_used'),
+        )
+        .where(model.list_id.in_(list_ids))
+        .group_by(func.lower(model.name))
+        .order_by(func.count().desc())
+        .limit(limit)
+    )
+
+
+class Vocabulary:
+    # One user's distinct item names with use counts, searchable by word
+    # prefix through a sorted (word, key) list
+
+    def __init__(self, list_ids, rows=()):
+        self.list_ids = list_ids
+        self.names = {}
+        self._lock = threading.Lock()
+        for row in rows:
+            self._add(row.name, row.uses, _naive_utc(row.last_used))
+        self.words = sorted((word, key) for key, entry in self.names.items() for word in entry[3])
+
+    def _add(self, name, uses, last_used):
+        # True if the name is new. Entries are [name, uses, last_used, words].
+        key = name.lower()
+        entry = self.names.get(key)
+        if entry is None:
+            self.names[key] = [name, uses, last_used, frozenset(search_terms(key))]
+            return True
+        entry[1] += uses
+        entry[2] = max(entry[2], last_used)
+        return False
+
+    def add(self, name, used_at):
+        with self._lock:
+            if self._add(name, 1, _naive_utc(used_at)):
+                key = name.lower()
+                for word in self.names[key][3]:
+                    insort(self.words, (word, key))
+
+    def search(self, terms, limit=SUGGESTION_LIMIT, now=None):
+        now = now or utcnow()
+        # Walk the words starting with the longest term, then check the rest
+        longest = max(terms, key=len)
+        others = [term for term in terms if term != longest]
+        matches = {}
+        with self._lock:
+            for index in range(bisect_left(self.words, (longest,)), len(self.words)):
+                word, key = self.words[index]
+                if not word.startswith(longest):
+                    break
+                entry = self.names[key]
+                if all(any(w.startswith(term) for w in entry[3]) for term in others):
+                    matches[key] = entry
+        best = heapq.nlargest(limit, matches.values(), key=lambda entry: rank(entry[1], entry[2], now))
+        return [suggestion(*entry[:3]) for entry in best]
+
+
+class ItemSearch:
+    # A user's first search is answered from the database index and starts
+    # loading their names into a Vocabulary in the background; later ones are
+    # answered from memory until VOCABULARY_TTL passes without a search.
+    # Item changes update loaded vocabularies in place.
+
+    def __init__(self, app):
+        self.app = app
+        self.vocabularies = TTLCache(maxsize=VOCABULARY_CACHE_SIZE, ttl=VOCABULARY_TTL)
+        self._by_list = {}
+        self._loading = set()
+        self._lock = threading.Lock()
+
+    def _vocabulary(self, user_id, list_ids):
+        vocabulary = self.vocabularies.get(user_id)
+        if vocabulary is not None and vocabulary.list_ids == list_ids:
+            # Keep it while the user is still typing
+            self.vocabularies.set(user_id, vocabulary)
+            return vocabulary
+        with self._lock:
+            if user_id in self._loading:
+                return None
+            self._loading.add(user_id)
+        threading.Thread(target=self._load, args=(user_id, list_ids), name='vocabulary-loader', daemon=True).start()
+        return None
+
+    def _load(self, user_id, list_ids):
+        try:
+            with self.app.app_context():
+                rows = db.session.execute(vocabulary_query(sorted(list_ids))).all()
+                # Archived items count too, so clearing a list doesn't
+                # forget its names; Vocabulary adds up the uses per name
+                rows += db.session.execute(vocabulary_query(sorted(list_ids), model=ArchivedItem)).all()
+            vocabulary = Vocabulary(list_ids, rows)
+            self.vocabularies.set(user_id, vocabulary)
+            with self._lock:
+                for list_id in list_ids:
+                    self._by_list.setdefault(list_id, weakref.WeakSet()).add(vocabulary)
+        except Exception:
+            self.app.logger.exception('Loading item names for user %s failed', user_id)
+        finally:
+            with self._lock:
+                self._loading.discard(user_id)
+
+    def search(self, user_id, text, limit=SUGGESTION_LIMIT):
+        terms = search_terms(text)
+        list_ids = get_access().list_ids(user_id)
+        if not terms or not list_ids:
+            return []
+
+        vocabulary = self._vocabulary(user_id, list_ids)
+        if vocabulary is not None:
+            return vocabulary.search(terms, limit)
+
+        now = utcnow()
+        query = item_search_query(db.engine.dialect.name, sorted(list_ids), terms)
+        rows = heapq.nlargest(limit, db.session.execute(query), key=lambda row: rank(row.uses, row.last_used, now))
+        return [suggestion(row.name, row.uses, row.last_used) for row in rows]
+
+    def record(self, list_id, names):
+        with self._lock:
+            vocabularies = list(self._by_list.get(list_id, ()))
+        now = utcnow()
+        for vocabulary in vocabularies:
+            for name in names:
+                vocabulary.add(name, now)
+
+
+def get_item_search():
+    return current_app.extensions['search']
+
+
+def _record_item_changes(list_id, version, events, **extra):
+    # Added and renamed items count as a use of their name. Deletes aren't
+    # subtracted; the vocabulary is rebuilt after VOCABULARY_TTL anyway.
+    names = [event['item']['name'] if event['op'] == 'add' else event['name']
+             for event in events if event['op'] in ('add', 'update')]
+    if names:
+        get_item_search().record(list_id, names)
+
+
+def create_search_index(connection):
+    if connection.dialect.name == 'sqlite':
+        statements = SQLITE_SEARCH_DDL
+    elif connection.dialect.name == 'postgresql':
+        statements = POSTGRES_SEARCH_DDL
+    else:
+        return
+    for statement in statements:
+        connection.execute(DDL(statement))
+
+
+def init_app(app):
+    app.extensions['search'] = ItemSearch(app)
+    items_changed.connect(_record_item_changes)
+    # db.create_all() (init-db, local runs) builds the index with the table
+    event.listen(GroceryItem.__table__, 'after_create',
+                 lambda target, connection, **kw: create_search_index(connection))
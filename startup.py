@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+
+import click
+from flask import current_app, g, request
+
+
+class StartupTimer:
+    # Records how long the app took to import, phase by phase, and how long
+    # its first request took, so cold starts can be compared across releases.
+    # `started` is a time.perf_counter() taken before the heavy imports.
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.marks = []
+        self.first_request = None
+        self._request_started = None
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        self.marks.append((phase, time.perf_counter()))
+
+    def _ms(self, seconds):
+        return round(seconds * 1000, 2)
+
+    def report(self):
+        phases, previous = {}, self.started
+        for phase, at in self.marks:
+            phases[phase] = self._ms(at - previous)
+            previous = at
+        report = {'import_ms': self._ms(previous - self.started), 'phases_ms': phases}
+        if self.first_request:
+            report['first_request'] = self.first_request
+        return report
+
+    def request_started(self):
+        if self.first_request is None and self._request_started is None:
+            with self._lock:
+                if self._request_started is None:
+                    self._request_started = time.perf_counter()
+                    return True
+        return False
+
+    def request_finished(self, endpoint):
+        now = time.perf_counter()
+        self.first_request = {
+            'endpoint': endpoint,
+            'duration_ms': self._ms(now - self._request_started),
+            'since_import_start_ms': self._ms(now - self.started),
+        }
+        return self.first_request
+
+
+@click.command('startup-report')
+@click.option('--path', default='/login', help='Request to time as the first one.')
+def startup_report_command(path):
+    """Print import and first-request timings for this process as JSON."""
+    current_app.test_client().get(path)
+    click.echo(json.dumps(current_app.extensions['startup'].report(), indent=2))
+
+
+def init_app(app, timer):
+    app.extensions['startup'] = timer
+    app.cli.add_command(startup_report_command)
+
+    @app.before_request
+    def _start_first_request_timer():
+        g.first_request = timer.request_started()
+
+    @app.after_request
+    def _finish_first_request_timer(response):
+        if g.pop('first_request', False):
+            first = timer.request_finished(request.endpoint)
+            response.headers.add('Server-Timing', f"cold-start;dur={first['since_import_start_ms']}")
+            app.logger.info('Cold start: %s', json.dumps(timer.report()))
+        return response
@@ -0,0 +1,152 @@
+import click
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, GroceryItem, ShoppingSummary
+from quantities import format_quantity, item_key, parse_quantity
+from queries import shopping_summary_query
+
+
+class SummaryDelta:
+    # Changes to one list's open items, accumulated while a batch of item
+    # operations is replayed and written with apply()
+
+    def __init__(self, list_id):
+        self.list_id = list_id
+        self.rows = {}
+
+    def add(self, name, value, unit, sign=1):
+        # sign=1 for an item that became open, -1 for one that stopped
+        # being open (completed, deleted, or about to be edited)
+        key = (item_key(name), unit or '')
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = {'name': name.strip(), 'open_items': 0, 'total': 0.0, 'unmeasured': 0}
+        row['open_items'] += sign
+        if value is None:
+            row['unmeasured'] += sign
+        else:
+            row['total'] += sign * value
+
+    def apply(self):
+        # Rows that drop to zero open items are kept: the same things tend
+        # to be bought again, and the shopping query skips them
+        rows = [
+            {'list_id': self.list_id, 'name_key': name_key, 'unit': unit, **row}
+            for (name_key, unit), row in self.rows.items()
+            if row['open_items'] or row['total'] or row['unmeasured']
+        ]
+        if not rows:
+            return
+        dialect = db.session.get_bind().dialect.name
+        insert = (postgresql if dialect == 'postgresql' else sqlite).insert
+        statement = insert(ShoppingSummary).values(rows)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['list_id', 'name_key', 'unit'],
+            set_={
+                'open_items': ShoppingSummary.open_items + statement.excluded.open_items,
+                'total': ShoppingSummary.total + statement.excluded.total,
+                'unmeasured': ShoppingSummary.unmeasured + statement.excluded.unmeasured,
+            },
+        ))
+
+
+def parsed_quantity_values(quantity):
+    value, unit = parse_quantity(quantity)
+    return {'quantity_value': value, 'quantity_unit': unit}
+
+
+def _summarize_items(list_ids=None):
+    # {list id: SummaryDelta} of the open items, counted from scratch
+    query = select(
+        GroceryItem.list_id, GroceryItem.name, GroceryItem.quantity_value, GroceryItem.quantity_unit,
+    ).where(GroceryItem.completed.is_not(True))
+    if list_ids is not None:
+        query = query.where(GroceryItem.list_id.in_(list_ids))
+    deltas = {}
+    for row in db.session.execute(query):
+        delta = deltas.get(row.list_id)
+        if delta is None:
+            delta = deltas[row.list_id] = SummaryDelta(row.list_id)
+        delta.add(row.name, row.quantity_value, row.quantity_unit)
+    return deltas
+
+
+def rebuild_summary(list_ids=None):
+    # Recompute the summary from the items, for repairs and backfills
+    deltas = _summarize_items(list_ids)
+    clear = delete(ShoppingSummary)
+    if list_ids is not None:
+        clear = clear.where(ShoppingSummary.list_id.in_(list_ids))
+    db.session.execute(clear, execution_options={'synchronize_session': False})
+    for delta in deltas.values():
+        delta.apply()
+    db.session.commit()
+    return len(deltas)
+
+
+def summary_mismatches(list_ids=None):
+    # (list id, name key, unit, stored, expected) for every summary row that
+    # disagrees with the items; counts are (open_items, total, unmeasured)
+    expected = {
+        (list_id, name_key, unit): (row['open_items'], round(row['total'], 6), row['unmeasured'])
+        for list_id, delta in _summarize_items(list_ids).items()
+        for (name_key, unit), row in delta.rows.items()
+    }
+    query = select(ShoppingSummary)
+    if list_ids is not None:
+        query = query.where(ShoppingSummary.list_id.in_(list_ids))
+    stored = {
+        (row.list_id, row.name_key, row.unit): (row.open_items, round(row.total, 6), row.unmeasured)
+        for row in db.session.scalars(query)
+        # apply() keeps rows that drop to zero
+        if row.open_items or row.total or row.unmeasured
+    }
+    empty = (0, 0.0, 0)
+    return [
+        (*key, stored.get(key, empty), expected.get(key, empty))
+        for key in sorted(stored.keys() | expected.keys())
+        if stored.get(key, empty) != expected.get(key, empty)
+    ]
+
+
+def shopping_list(list_ids):
+    # One entry per thing to buy across `list_ids` with a total per unit,
+    # e.g. {'name': 'Milk', 'amounts': ['2.5 l', '1 carton'], 'open_items': 3, ...}
+    entries = {}
+    for row in db.session.execute(shopping_summary_query(list_ids)):
+        entry = entries.get(row.name_key)
+        if entry is None:
+            entry = entries[row.name_key] = {'name': row.name, 'amounts': [], 'open_items': 0, 'unmeasured': 0}
+        if row.open_items > row.unmeasured:
+            entry['amounts'].append(format_quantity(row.total, row.unit))
+        entry['open_items'] += row.open_items
+        entry['unmeasured'] += row.unmeasured
+    return list(entries.values())
+
+
+@click.command('rebuild-shopping-summary')
+def rebuild_shopping_summary_command():
+    """Reparse item quantities and recompute the shopping summary table."""
+    items = db.session.execute(select(GroceryItem.id, GroceryItem.quantity)).all()
+    updates = [{'id': item.id, **parsed_quantity_values(item.quantity)} for item in items]
+    if updates:
+        db.session.execute(update(GroceryItem), updates)
+    click.echo(f'Parsed {len(updates)} quantities, summarized {rebuild_summary()} lists.')
+
+
+@click.command('check-shopping-summary')
+def check_shopping_summary_command():
+    """Compare the shopping summary table with a recount of the open items."""
+    mismatches = summary_mismatches()
+    for list_id, name_key, unit, stored, expected in mismatches:
+        click.echo(f'list {list_id} {name_key!r} {unit!r}: stored {stored}, items say {expected}')
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} summary rows are off; '
+                                   'run `flask rebuild-shopping-summary` to repair them')
+    click.echo('Shopping summary matches the items.')
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_shopping_summary_command)
+    app.cli.add_command(check_shopping_summary_command)
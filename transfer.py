@@ -0,0 +1,266 @@
+import codecs
+import csv
+import io
+import json
+import os
+import shutil
+import uuid
+
+import click
+from flask import Response, abort, stream_with_context
+from sqlalchemy import select
+from werkzeug.utils import secure_filename
+
+from jobs import job_files_dir, job_kind
+from models import db, GroceryItem, GroceryList, User
+from mutations import MAX_BATCH_OPS, apply_item_ops
+from queries import export_items_query
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'json': 'application/json'}
+EXPORT_COLUMNS = ('list', 'name', 'quantity', 'completed', 'added_at', 'added_by')
+# Rows fetched per round trip while exporting
+EXPORT_FETCH_SIZE = 1000
+# Response chunks are flushed once they reach this many characters, and
+# uploads are read this many bytes at a time
+BUFFER_SIZE = 64 * 1024
+# Longest JSON record accepted on import
+MAX_RECORD_SIZE = 1024 * 1024
+# Items added per apply_item_ops batch (and commit) while importing
+IMPORT_CHUNK_SIZE = MAX_BATCH_OPS
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'x')
+IMPORT_MIMETYPES = {
+    'text/csv': 'csv',
+    'application/json': 'json',
+    'application/x-ndjson': 'json',
+    'application/jsonl': 'json',
+}
+
+
+# Export
+
+def _export_rows(list_ids):
+    result = db.session.execute(
+        export_items_query(list_ids), execution_options={'yield_per': EXPORT_FETCH_SIZE},
+    )
+    for row in result:
+        yield (
+            row.list_name,
+            row.name,
+            row.quantity,
+            bool(row.completed),
+            row.added_at.isoformat() if row.added_at else None,
+            row.added_by,
+        )
+
+
+def _buffered(pieces):
+    # Joins small strings into response chunks of about BUFFER_SIZE
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _csv_lines(rows):
+    line = io.StringIO()
+    writer = csv.writer(line)
+    for row in rows:
+        writer.writerow(row)
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+
+
+def _with_header(rows):
+    yield EXPORT_COLUMNS
+    yield from rows
+
+
+def export_csv(list_ids):
+    return _buffered(_csv_lines(_with_header(_export_rows(list_ids))))
+
+
+def _json_pieces(rows):
+    # A JSON array written one item at a time
+    yield '['
+    separator = '\n'
+    for row in rows:
+        yield separator + json.dumps(dict(zip(EXPORT_COLUMNS, row)))
+        separator = ',\n'
+    yield '\n]\n'
+
+
+def export_json(list_ids):
+    return _buffered(_json_pieces(_export_rows(list_ids)))
+
+
+def export_response(list_ids, format, name):
+    # Streams the items of `list_ids` as an attachment; memory use doesn't
+    # grow with the number of items
+    if format not in EXPORT_FORMATS:
+        abort(400, description=f"Unknown export format; choose from {', '.join(EXPORT_FORMATS)}")
+    body = export_csv(list_ids) if format == 'csv' else export_json(list_ids)
+    filename = f"{secure_filename(name) or 'grocery-list'}.{format}"
+    return Response(stream_with_context(body), mimetype=EXPORT_FORMATS[format], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-store',
+    })
+
+
+# Import
+
+def upload_format(filename=None, mimetype=None):
+    # 'csv' or 'json' from the file name or content type, None if neither
+    extension = (filename or '').rpartition('.')[2].lower()
+    if extension == 'csv':
+        return 'csv'
+    if extension in ('json', 'jsonl', 'ndjson'):
+        return 'json'
+    return IMPORT_MIMETYPES.get(mimetype)
+
+
+def _csv_records(text):
+    yield from csv.DictReader(text)
+
+
+def _json_records(text):
+    # Objects from a JSON array or from JSON Lines, decoded as the upload is
+    # read instead of loading the whole document
+    decoder = json.JSONDecoder()
+    buffer, position, finished = '', 0, False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            position += 1
+        if position < len(buffer):
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if finished or len(buffer) - position > MAX_RECORD_SIZE:
+                    raise
+            else:
+                yield record
+                continue
+        if finished:
+            return
+        chunk = text.read(BUFFER_SIZE)
+        finished = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
+
+def read_records(stream, format):
+    # Dicts read from a binary upload stream in `format`
+    text = codecs.getreader('utf-8-sig')(stream)
+    return _csv_records(text) if format == 'csv' else _json_records(text)
+
+
+def _add_op(record):
+    if not isinstance(record, dict):
+        return None
+    name, quantity = record.get('name'), record.get('quantity')
+    if not isinstance(name, str) or not name.strip() or len(name) > GroceryItem.name.type.length:
+        return None
+    if quantity is not None:
+        quantity = str(quantity)[:GroceryItem.quantity.type.length] or None
+    completed = record.get('completed')
+    if isinstance(completed, str):
+        completed = completed.strip().lower() in TRUE_VALUES
+    return {'op': 'add', 'name': name.strip(), 'quantity': quantity, 'completed': bool(completed)}
+
+
+def import_items(list_id, user_id, records, chunk_size=IMPORT_CHUNK_SIZE, key_prefix=None):
+    # Adds `records` to the list in batches of `chunk_size`, each applied and
+    # committed like any other batch of item operations. Yields progress
+    # after every batch; the last one has done=True and, if the upload
+    # couldn't be parsed to the end, an error. Batches before an error stay
+    # imported. With a `key_prefix` each batch gets an idempotency key, so
+    # importing the same file again skips the batches already added.
+    progress = {'imported': 0, 'skipped': 0}
+    chunk, batches = [], 0
+
+    def apply(chunk):
+        nonlocal batches
+        batches += 1
+        key = f'{key_prefix}-{batches}' if key_prefix else None
+        apply_item_ops(list_id, user_id, chunk, idempotency_key=key)
+        progress['imported'] += len(chunk)
+
+    try:
+        for record in records:
+            op = _add_op(record)
+            if op is None:
+                progress['skipped'] += 1
+                continue
+            chunk.append(op)
+            if len(chunk) >= chunk_size:
+                apply(chunk)
+                chunk = []
+                yield dict(progress)
+    except (ValueError, csv.Error) as error:
+        # ValueError covers bad JSON and undecodable bytes
+        progress['error'] = str(error)
+    if chunk:
+        apply(chunk)
+    yield {**progress, 'done': True}
+
+
+def spool_upload(stream, format):
+    # Saves an upload for an import job and returns its path
+    path = os.path.join(job_files_dir(), f'{uuid.uuid4().hex}.{format}')
+    with open(path, 'wb') as spool:
+        shutil.copyfileobj(stream, spool, BUFFER_SIZE)
+    return path
+
+
+@job_kind('import-items')
+def import_items_job(job, list_id, user_id, path, format):
+    # A retried job re-reads the file from the start; the batch keys make
+    # the batches an earlier attempt committed no-ops
+    try:
+        grocery_list = db.session.get(GroceryList, list_id)
+        if grocery_list is None or grocery_list.deleted_at is not None:
+            progress = {'imported': 0, 'skipped': 0, 'done': True, 'error': 'The list was deleted'}
+        else:
+            with open(path, 'rb') as upload:
+                for progress in import_items(list_id, user_id, read_records(upload, format), key_prefix=f'job-{job.id}'):
+                    job.progress(progress)
+    except Exception:
+        if job.last_attempt:
+            os.remove(path)
+        raise
+    os.remove(path)
+    return progress
+
+
+@click.command('import-items')
+@click.argument('list_id', type=int)
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', 'format', type=click.Choice(['csv', 'json']), help='Defaults to the file extension.')
+@click.option('--user', 'username', help='Who the items are added by; defaults to the list owner.')
+def import_items_command(list_id, file, format, username):
+    """Import items into a list from a CSV or JSON file (- for stdin)."""
+    grocery_list = db.session.get(GroceryList, list_id)
+    if grocery_list is None or grocery_list.deleted_at is not None:
+        raise click.ClickException(f'No list {list_id}')
+    user_id = grocery_list.user_id
+    if username:
+        user_id = db.session.scalar(select(User.id).where(User.username == username))
+        if user_id is None:
+            raise click.ClickException(f'No user {username}')
+    format = format or upload_format(file.name)
+    if format is None:
+        raise click.ClickException('Pass --format csv or --format json')
+
+    for progress in import_items(list_id, user_id, read_records(file, format)):
+        click.echo(f"{progress['imported']} imported, {progress['skipped']} skipped")
+    if 'error' in progress:
+        raise click.ClickException(f"Stopped early: {progress['error']}")
+
+
+def init_app(app):
+    app.cli.add_command(import_items_command)